@@ -1,18 +1,20 @@
 from typing import List, Union
 
 from node import Node, euclidean_distance
+from geometry import Geometry
 
 
 class Arc:
     ''' A class defining Arc objects '''
 
-    def __init__(self, start: Node, end: Node) -> None:
+    def __init__(self, start: Node, end: Node, geometry: Geometry = None) -> None:
         """
         Initialize an Arc object.
 
         Parameters:
             start (Node): The start node of the edge (arc).
             end (Node): The end node of the edge (arc).
+            geometry (Geometry): Precomputed distances of the instance (optional).
         """
         self.start: Node = start  # start node of the edge (arc)
         self.end: Node = end  # end node of the edge (arc)
@@ -20,11 +22,14 @@ class Arc:
         self.savings: float = 0.0  # edge savings (Clarke & Wright)
         self.efficiency: float = 0.0  # edge efficiency (enriched savings)
 
-        self.calc_cost()
+        self.calc_cost(geometry)
 
-    def calc_cost(self):
-        self.cost = euclidean_distance(self.start, self.end)
-        return self.cost 
+    def calc_cost(self, geometry: Geometry = None):
+        if geometry is not None:
+            self.cost = geometry.distance(self.start, self.end)
+        else:
+            self.cost = euclidean_distance(self.start, self.end)
+        return self.cost
 
     def __str__(self) -> str:
         return f"Arc {self.start.id}-{self.end.id}"
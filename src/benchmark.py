@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+import numpy as np
+
+from importer import Importer
+from efficiencylist import EfficiencyList
+from emulation import Emulation, dynamic_param
+from heuristic import pj_heuristic, generate_new_route
+from simlearnheur import SimLearnHeuristic
+
+DEFAULT_SIZES = [32, 64, 128, 256, 512, 1000, 2000, 5000]
+
+# largest instance size timed by default for each phase (the slow ones grow quadratically or worse)
+PHASE_MAX_SIZE = {
+    "importer": None,
+    "generate": 2000,
+    "pj_greedy": 1000,
+    "pj_br": 1000,
+    "generate_new_route": 1000,
+    "episode": 256,
+}
+
+
+def generate_instance(n_nodes: int, seed: int, file_path: str, budget_ratio: float = 0.5, side: float = 100.0) -> str:
+    """
+    Write a random OP instance with n_nodes nodes (start and end depots included) in the
+    text format read by the Importer: a "Tmax P" line, then the start depot, the end depot
+    and the customers as "x y score" lines.
+    The budget is budget_ratio times the expected length of a TSP tour over all the nodes
+    (0.7124 * sqrt(n * area)), and never less than 1.1 times the depot-to-depot distance.
+
+    :param n_nodes: number of nodes of the instance (>= 3).
+    :param seed: seed of the instance.
+    :param file_path: path of the file to write.
+    :param budget_ratio: budget as a fraction of the expected TSP tour length.
+    :param side: side of the square where the nodes are placed.
+    :return: file_path.
+    """
+    rng = np.random.default_rng(seed)
+    xy = np.round(rng.uniform(0, side, size=(n_nodes, 2)), 1)
+    scores = rng.integers(1, 11, size=n_nodes)
+    scores[:2] = 0  # depots have no reward
+    depot_distance = math.dist(xy[0], xy[1])
+    tmax = max(budget_ratio * 0.7124 * math.sqrt(n_nodes * side * side), 1.1 * depot_distance)
+    with open(file_path, "w") as file:
+        file.write(f"{tmax:.1f}\t1\n")
+        for (x, y), score in zip(xy, scores):
+            file.write(f"{x:.1f}\t{y:.1f}\t{score}\n")
+    return file_path
+
+
+def time_call(function, repeat: int):
+    """ Run function repeat times and return (list of wall times in seconds, last result) """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def bench_instance(file_path: str, phases, repeat: int, seed: int):
+    """
+    Time the selected phases on one instance file.
+
+    :return: dictionary phase -> list of wall times (seconds).
+    """
+    timings = {}
+    times, importer = time_call(lambda: Importer(file_path), repeat)
+    nodes, max_cost = importer.node_data, importer.Tmax
+    if "importer" in phases:
+        timings["importer"] = times
+
+    eff_list = None
+    if phases & {"generate", "pj_greedy", "pj_br", "generate_new_route"}:
+        times, eff_list = time_call(lambda: EfficiencyList(nodes).generate(alpha=0.5), repeat)
+        if "generate" in phases:
+            timings["generate"] = times
+    if "pj_greedy" in phases:
+        timings["pj_greedy"], _ = time_call(lambda: pj_heuristic(nodes, eff_list, max_cost, useBR=False), repeat)
+    if "pj_br" in phases:
+        rng = random.Random(seed)
+        timings["pj_br"], _ = time_call(lambda: pj_heuristic(nodes, eff_list, max_cost, useBR=True, rng=rng), repeat)
+    if "generate_new_route" in phases:
+        # replan after the first step of an emulation
+        emulation = Emulation(nodes, max_cost, eff_list.geometry)
+        emulation.update_parameters(dynamic_param())
+        emulation.step(generate_new_route(emulation, eff_list).get_best_route().get_nodes()[1])
+        timings["generate_new_route"], _ = time_call(lambda: generate_new_route(emulation, eff_list), repeat)
+    if "episode" in phases:
+        procedure = SimLearnHeuristic(0, 0, 0)
+        timings["episode"], _ = time_call(lambda: procedure.run_heuristic("basic_pj", nodes, max_cost), repeat)
+    return timings
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(sizes, phases, repeat: int = 3, seed: int = 0, instance_dir: str = None, all_sizes: bool = False):
+    """
+    Generate one seeded instance per size and time the selected phases on it.
+
+    :param sizes: instance sizes (number of nodes).
+    :param phases: names of the phases to time (see PHASE_MAX_SIZE).
+    :param repeat: number of timed repetitions of each phase.
+    :param seed: seed of the instances (instance of size n uses seed + n) and of the BR runs.
+    :param instance_dir: directory where the instances are written (temporary if None).
+    :param all_sizes: time every phase at every size, ignoring PHASE_MAX_SIZE.
+    :return: machine-readable dictionary with the environment and one record per (size, phase).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        directory = instance_dir or tmp_dir
+        os.makedirs(directory, exist_ok=True)
+        for size in sizes:
+            size_phases = {phase for phase in phases
+                           if all_sizes or PHASE_MAX_SIZE[phase] is None or size <= PHASE_MAX_SIZE[phase]}
+            if not size_phases:
+                continue
+            file_path = generate_instance(size, seed + size, os.path.join(directory, f"bench_{size}_{seed + size}.txt"))
+            timings = bench_instance(file_path, size_phases, repeat, seed)
+            for phase in phases:
+                if phase not in timings:
+                    continue
+                results.append({
+                    "size": size,
+                    "phase": phase,
+                    "repeat": repeat,
+                    "min": min(timings[phase]),
+                    "median": statistics.median(timings[phase]),
+                    "times": timings[phase],
+                })
+                print(f"n={size:5d} {phase:20s} min={results[-1]['min']:.4f}s median={results[-1]['median']:.4f}s", file=sys.stderr)
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 1.2):
+    """
+    Compare two benchmark outputs (min times of the common (size, phase) records).
+
+    :return: list of (size, phase, baseline min, current min, ratio) slower than threshold.
+    """
+    old = {(record["size"], record["phase"]): record["min"] for record in baseline["results"]}
+    regressions = []
+    for record in current["results"]:
+        key = (record["size"], record["phase"])
+        if key in old and old[key] > 0:
+            ratio = record["min"] / old[key]
+            if ratio > threshold:
+                regressions.append((record["size"], record["phase"], old[key], record["min"], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SimLearnHeuristic benchmarks on generated OP instances")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--phases", nargs="+", default=list(PHASE_MAX_SIZE), choices=list(PHASE_MAX_SIZE))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--all-sizes", action="store_true", help="ignore the default size limit of each phase")
+    parser.add_argument("--instance-dir", default=None, help="keep the generated instances in this directory")
+    parser.add_argument("--output", default=None, help="JSON output file (stdout if not given)")
+    parser.add_argument("--compare", default=None, help="baseline JSON output to compare with")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    output = run_benchmarks(args.sizes, args.phases, args.repeat, args.seed, args.instance_dir, args.all_sizes)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), output, args.threshold)
+        for size, phase, old_time, new_time, ratio in regressions:
+            print(f"REGRESSION n={size} {phase}: {old_time:.4f}s -> {new_time:.4f}s (x{ratio:.2f})", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
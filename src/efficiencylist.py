@@ -1,99 +1,523 @@
-import operator
 import numpy as np
-import copy
 
 # from node import euclidean_distance
 from arc import Arc
+from geometry import Geometry
 from importer import Importer
+from logs import get_logger
+from metrics import timed
+
+logger = get_logger(__name__)
 
 class EfficiencyList():
     """
     The efficiency list is a list containing all* arcs in the node network
     The efficiency list is ordered by efficiency
     The efficiency is calculated as proposed in Panadero et al.(2020) 
+
+    The arcs are stored column-wise in NumPy arrays (start, end, cost, savings, efficiency),
+    indexed by arc position: arc 2k is (i,j) and arc 2k+1 is its inverse (j,i).
+    Arc objects are only created when an arc is handed out by pop_arc.
+
+    The sorted order itself is never modified: removed arcs are tombstoned and a Fenwick
+    tree over the sorted positions counts the arcs still in the list, so that selecting
+    the arc at a given position (pop_arc), deleting the inverse arc and filtering the
+    arcs of a node take O(log n) per arc removed.
+
+    In sparse mode (k_nearest and/or radius given) only the pairs of customers where one of
+    them is among the k nearest or k best savings partners of the other (and/or within the
+    radius) get arcs, so the list grows as O(n k) instead of O(n^2). The pairs are then looked
+    up in a sorted array of pair keys and the arcs of each customer in an incidence (CSR) structure.
+    Many routes may be left with no arc between their endpoints, so the PJ heuristic goes on with
+    a dense sublist of these endpoints when a sparse list runs out (see sublist).
+
+    The sorted order is built lazily: the arcs are kept in an unsorted pool and sorted chunks
+    (top arcs selected with argpartition, doubling in size) are appended to the sorted prefix
+    only when a pop reaches past the arcs already sorted. Ties are broken by arc position as in
+    a full stable sort, so the order (and the biased selection) is the same as sorting everything.
     """
-    def __init__(self, nodes) -> None:
+    # rows of the distance matrix processed at once when searching the neighbours
+    NEIGHBOR_CHUNK = 1024
+    # size of the first sorted chunk of a lazy list (the next ones double)
+    FIRST_CHUNK = 256
+
+    def __init__(self, nodes, geometry: Geometry = None, k_nearest: int = None, radius: float = None,
+                 lazy: bool = True) -> None:
+        """
+        :param nodes: nodes of the network: start depot, customers, end depot.
+        :param geometry: distances of the instance (computed if not provided).
+        :param k_nearest: sparse mode, keep the arcs between each customer and its k nearest customers
+            and its k best savings partners.
+        :param radius: sparse mode, keep the arcs between customers closer than radius.
+        :param lazy: sort the arcs in chunks, only as far as they are popped.
+        """
         self.nodes = nodes
-        self.efficiency_list = []
+        self.lazy = lazy
+        self.k_nearest = k_nearest
+        self.radius = radius
+        # distances are looked up in the instance geometry (computed here if not shared)
+        self.geometry = geometry if geometry is not None else Geometry(nodes)
+        self.node_by_id = {node.id: node for node in nodes}
+        self.start = np.empty(0, dtype=np.int32)  # start node id of each arc
+        self.end = np.empty(0, dtype=np.int32)  # end node id of each arc
+        self.cost = np.empty(0)  # edge cost of each arc
+        self.savings = np.empty(0)  # edge savings of each arc (Clarke & Wright)
+        self.efficiency = np.empty(0)  # edge efficiency of each arc (enriched savings)
+        self.edge_reward = np.empty(0)  # reward of both nodes of each arc
+        self.alpha: float = None  # weight of the savings in the efficiency
+        self._position = np.empty(0, dtype=np.intp)  # node id -> position among the customers
+        self._n_customers = 0  # number of customers the arc arrays were generated for
+        self._pair_keys = None  # sparse mode: sorted keys (low * n_customers + high) of the pairs
+        self._incident_ptr = None  # sparse mode: customer position -> slice of _incident
+        self._incident = None  # sparse mode: pairs of each customer
+        self._alive = np.empty(0, dtype=bool)  # arc still in the list
+        self._order = np.empty(0, dtype=np.intp)  # sorted position -> arc (decreasing efficiency), sorted prefix of a lazy list
+        self._pool = np.empty(0, dtype=np.intp)  # arcs not sorted yet (lazy list), by arc position
+        self._rank = np.empty(0, dtype=np.intp)  # arc -> sorted position (-1 if not sorted)
+        self._tree = [0]  # Fenwick tree (1-based) counting the arcs left at each sorted position
+        self._size = 0  # number of arcs left in the list
+        self._sorted_size = 0  # number of arcs left in the sorted prefix
+        self._savings_pool = None  # arcs not swept yet by savings (see discard_below_savings)
+        self._savings_chunk = None  # lowest savings arcs of the pool, by increasing savings
+        self._chunk_savings = None  # savings of the arcs of _savings_chunk
+        self._savings_pointer = 0  # arcs of _savings_chunk already discarded
+
+    @classmethod
+    def from_arrays(cls, nodes, geometry: Geometry, arrays, alpha: float, n_customers: int):
+        """
+        Efficiency list over existing arc arrays (e.g. in shared memory), without copying them.
+        The arrays (see SharedInstance) are start, end, cost, savings, edge_reward, efficiency,
+        position (node id -> customer position), order (sorted arcs still in the list) and
+        optionally rank (arc -> position in order, -1 if not in it), plus pair_keys, incident_ptr
+        and incident for a sparse list. Only the alive flags and the Fenwick tree are allocated.
+        """
+        new = cls(nodes, geometry)
+        for name in ("start", "end", "cost", "savings", "edge_reward", "efficiency"):
+            setattr(new, name, arrays[name])
+        if "pair_keys" in arrays:
+            new._pair_keys, new._incident_ptr, new._incident = arrays["pair_keys"], arrays["incident_ptr"], arrays["incident"]
+        new._position = arrays["position"]
+        new._n_customers = n_customers
+        new.alpha = alpha
+        new._alive = np.zeros(len(new.start), dtype=bool)
+        new._alive[arrays["order"]] = True
+        new._set_order(arrays["order"], arrays.get("rank"))
+        return new
 
     def __len__(self):
-        return len(self.efficiency_list)
+        return self._size
+
+    def __iter__(self):
+        self._extend_order(len(self._pool))
+        for index in self._order:
+            if self._alive[index]:
+                yield self._make_arc(index)
+
+    def __copy__(self):
+        """ Copies share the (read-only) arc arrays but not the list state """
+        new = EfficiencyList.__new__(EfficiencyList)
+        new.__dict__.update(self.__dict__)
+        new._alive = self._alive.copy()
+        new._tree = list(self._tree)
+        if len(self._pool):
+            # the ranks of a lazy list are set independently by each copy as its sorted prefix grows
+            new._rank = self._rank.copy()
+        return new
+
+    def _set_order(self, order, rank=None):
+        """ Set the sorted arcs of the list (all of them alive, ranks computed if not given) and build the Fenwick tree """
+        self._order = order
+        self._pool = np.empty(0, dtype=np.intp)
+        if rank is None:
+            rank = np.full(len(self.start), -1, dtype=np.intp)
+            rank[order] = np.arange(len(order))
+        self._rank = rank
+        # every position holds one arc: tree[i] = lowbit(i)
+        lowbit = np.arange(1, len(order) + 1)
+        np.bitwise_and(lowbit, -lowbit, out=lowbit)
+        self._tree = [0] + lowbit.tolist()
+        self._size = len(order)
+        self._sorted_size = len(order)
+        self._savings_pool = None
+
+    def _sort_arcs(self, index):
+        """ Set the arcs of the list (all of them alive, by arc position), sorted now or lazily """
+        if not self.lazy:
+            self._set_order(index[np.argsort(-self.efficiency[index], kind="stable")])
+            return
+        self._order = np.empty(0, dtype=np.intp)
+        self._pool = index
+        self._rank = np.full(len(self.start), -1, dtype=np.intp)
+        self._tree = [0]
+        self._size = len(index)
+        self._sorted_size = 0
+        self._savings_pool = None
+
+    def _extend_order(self, count):
+        """
+        Append (at least) the next count arcs left in the pool to the sorted prefix: the top arcs
+        are selected with argpartition (ties by arc position) and sorted, and the Fenwick tree is
+        grown from the alive flags of the sorted positions.
+        """
+        if not len(self._pool):
+            return
+        pool = self._pool[self._alive[self._pool]]
+        if count < len(pool):
+            key = -self.efficiency[pool]
+            threshold = np.partition(key, count - 1)[count - 1]
+            selected = key < threshold
+            # the arcs tied at the threshold are taken by arc position (pool is sorted by position)
+            tied = np.flatnonzero(key == threshold)[:count - np.count_nonzero(selected)]
+            selected[tied] = True
+            chunk, self._pool = pool[selected], pool[~selected]
+        else:
+            chunk, self._pool = pool, np.empty(0, dtype=np.intp)
+        chunk = chunk[np.argsort(-self.efficiency[chunk], kind="stable")]
+
+        first = len(self._order)
+        self._rank[chunk] = np.arange(first, first + len(chunk))
+        # a new array: the prefix may be shared with copies
+        self._order = np.concatenate((self._order, chunk))
+        self._tree.extend(self._tree_nodes(self._alive[self._order], first).tolist())
+        self._sorted_size += len(chunk)
+
+    @staticmethod
+    def _tree_nodes(alive, first):
+        """
+        Fenwick tree nodes of the sorted positions after first, from the alive flags of all the
+        sorted positions: tree[i] counts the arcs left at the sorted positions (i - lowbit(i), i].
+        """
+        prefix = np.zeros(len(alive) + 1, dtype=np.intp)
+        np.cumsum(alive, out=prefix[1:])
+        position = np.arange(first + 1, len(alive) + 1)
+        return prefix[position] - prefix[position - (position & -position)]
+
+    def sorted_arcs(self):
+        """ Positions of the arcs left in the list, in sorted order """
+        self._extend_order(len(self._pool))
+        return self._order[self._alive[self._order]]
+
+    def _tree_add(self, rank, delta):
+        tree = self._tree
+        i = rank + 1
+        n = len(tree)
+        while i < n:
+            tree[i] += delta
+            i += i & -i
+
+    def _tree_find(self, index):
+        """ Sorted position of the arc at position index among the arcs left """
+        tree = self._tree
+        n = len(tree)
+        rank = 0
+        step = 1 << (n - 1).bit_length()
+        while step:
+            i = rank + step
+            if i < n and tree[i] <= index:
+                rank = i
+                index -= tree[i]
+            step >>= 1
+        return rank
+
+    def _discard(self, arc_index):
+        """ Tombstone an arc still in the list """
+        self._alive[arc_index] = False
+        self._size -= 1
+        rank = self._rank[arc_index]
+        if rank >= 0: # arcs still in the pool of a lazy list are only tombstoned
+            self._sorted_size -= 1
+            self._tree_add(rank, -1)
+
+    def _make_arc(self, index):
+        arc = Arc(self.node_by_id[self.start[index]], self.node_by_id[self.end[index]], self.geometry)
+        arc.savings = float(self.savings[index])
+        arc.efficiency = float(self.efficiency[index])
+        return arc
+
+    def _arc_index(self, start_id, end_id):
+        """ Position in the arc arrays of the arc (start, end) """
+        a = self._position[start_id]
+        b = self._position[end_id]
+        if a < 0 or b < 0 or a == b:
+            return -1
+        low, high = min(a, b), max(a, b)
+        m = self._n_customers
+        if self._pair_keys is None:
+            pair = low * m - low * (low + 1) // 2 + (high - low - 1)
+        else:
+            key = low * m + high
+            pair = int(np.searchsorted(self._pair_keys, key))
+            if pair == len(self._pair_keys) or self._pair_keys[pair] != key:
+                return -1
+        return 2 * pair + (0 if a < b else 1)
+
+    def _sparse_pairs(self, customers):
+        """
+        Pairs (low, high) of customer positions, low < high and sorted, of the sparse list:
+        each customer is paired with its k nearest customers and with the k customers giving
+        the highest savings with it (in either direction), which the merges of distant routes need;
+        with a radius, only the pairs closer than the radius are kept (all of them if k is None).
+        """
+        dist = self.geometry.matrix
+        start_id, end_id = self.nodes[0].id, self.nodes[-1].id
+        m = len(customers)
+        k = self.k_nearest
+        keys = []
+        for first in range(0, m, self.NEIGHBOR_CHUNK):
+            rows = np.arange(first, min(first + self.NEIGHBOR_CHUNK, m))
+            block = dist[np.ix_(customers[rows], customers)]
+            block[np.arange(len(rows)), rows] = np.inf  # a customer is not its own neighbour
+            if k is not None and k < m - 1:
+                # savings of the arcs (i, j) and (j, i) of each row customer i
+                savings = np.maximum(dist[start_id, customers][np.newaxis, :] + dist[customers[rows], end_id][:, np.newaxis],
+                                     dist[start_id, customers[rows]][:, np.newaxis] + dist[customers, end_id][np.newaxis, :]) - block
+                columns = np.concatenate((np.argpartition(block, k, axis=1)[:, :k],
+                                          np.argpartition(-savings, k, axis=1)[:, :k]), axis=1)
+                row_index = np.repeat(rows, 2 * k)
+                columns = columns.ravel()
+            else:
+                row_index, columns = np.nonzero(np.isfinite(block))
+                row_index = rows[row_index]
+            if self.radius is not None:
+                within = dist[customers[row_index], customers[columns]] <= self.radius
+                row_index, columns = row_index[within], columns[within]
+            low, high = np.minimum(row_index, columns), np.maximum(row_index, columns)
+            keys.append(low.astype(np.int64) * m + high)
+        keys = np.unique(np.concatenate(keys)) if keys else np.empty(0, dtype=np.int64)
+        return keys // m, keys % m, keys
+
+    @property
+    def is_sparse(self):
+        return self._pair_keys is not None
+
+    def sublist(self, customers):
+        """
+        Dense efficiency list over some of the customers of this list, with the same depots,
+        geometry and alpha (e.g. the endpoints of the routes left when a sparse list runs out).
+        """
+        return EfficiencyList([self.nodes[0]] + list(customers) + [self.nodes[-1]], self.geometry,
+                              lazy=self.lazy).generate(self.alpha)
 
     def pop_arc(self, index):
-        return self.efficiency_list.pop(index)
+        if not 0 <= index < self._size:
+            raise IndexError("pop index out of range")
+        if index >= self._sorted_size:
+            self._extend_order(max(index + 1 - self._sorted_size, self.FIRST_CHUNK, len(self._order)))
+        arc_index = self._order[self._tree_find(index)]
+        self._discard(arc_index)
+        return self._make_arc(arc_index)
 
+    @timed("efficiency_list.generate")
     def generate(self, alpha: float):
         """
-        the loop starts from node i = 1 (excluding the start) and j = 2
-        it does not consider the case when i = j because starts always at i+1
-        it also excludes the end node
-        """
-        for i in range(1, len(self.nodes) - 2):
-            for j in range(i + 1, len(self.nodes) - 1):
-                node_i = self.nodes[i]
-                node_j = self.nodes[j]
-                edgeReward = node_i.reward + node_j.reward
-
-                # calculate arc (i,j)
-                arc_i_j = Arc(node_i, node_j)
-                start_j_arc = Arc(self.nodes[0], node_j)
-                i_end_arc = Arc(node_i, self.nodes[-1])
-                savings_i_j = start_j_arc.cost + i_end_arc.cost - arc_i_j.cost
-                arc_i_j.savings = savings_i_j
-                arc_i_j.efficiency = alpha * savings_i_j + (1 - alpha) * edgeReward
-                self.efficiency_list.append(arc_i_j)
-
-                # calculate arc (j,i)
-                arc_j_i = Arc(node_j, node_i)
-                start_i_arc = Arc(self.nodes[0], node_i)
-                j_end_arc = Arc(node_j, self.nodes[-1])
-                savings_j_i = start_i_arc.cost + j_end_arc.cost - arc_j_i.cost
-                arc_j_i.savings = savings_j_i
-                arc_j_i.efficiency = alpha * savings_j_i + (1 - alpha) * edgeReward
-                self.efficiency_list.append(arc_j_i)
+        Arcs are all the ordered pairs of customers: the first and last nodes of the
+        list (start and end depots) are excluded, and so is the case i = j.
+        Savings and efficiencies are computed with broadcasting over the distance matrix
+        and sorted by a (stable) argsort, all at once or lazily, so ties keep the generation order.
+        """
+        dist = self.geometry.matrix
+        start_id = self.nodes[0].id
+        end_id = self.nodes[-1].id
+        customers = np.array([node.id for node in self.nodes[1:-1]], dtype=np.int32)
+        self._position = np.full(len(self.geometry), -1, dtype=np.intp)
+        self._position[customers] = np.arange(len(customers))
+        self._n_customers = len(customers)
+
+        # pairs i < j (in list order), interleaved as arc (i,j) followed by arc (j,i)
+        if self.k_nearest is None and self.radius is None:
+            i, j = np.triu_indices(len(customers), 1)
+            self._pair_keys = self._incident_ptr = self._incident = None
+        else:
+            i, j, self._pair_keys = self._sparse_pairs(customers)
+            # pairs of each customer, grouped by customer position
+            endpoints = np.concatenate((i, j))
+            self._incident = np.concatenate((np.arange(len(i)), np.arange(len(i))))[np.argsort(endpoints, kind="stable")]
+            self._incident_ptr = np.zeros(len(customers) + 1, dtype=np.intp)
+            np.cumsum(np.bincount(endpoints, minlength=len(customers)), out=self._incident_ptr[1:])
+        self.start = np.empty(2 * len(i), dtype=np.int32)
+        self.end = np.empty(2 * len(i), dtype=np.int32)
+        self.start[0::2], self.start[1::2] = customers[i], customers[j]
+        self.end[0::2], self.end[1::2] = customers[j], customers[i]
+
+        self.cost = dist[self.start, self.end]
+        self.savings = dist[start_id, self.end] + dist[self.start, end_id] - self.cost
+        self.edge_reward = self.geometry.reward[self.start] + self.geometry.reward[self.end]
+        self.efficiency = alpha * self.savings + (1 - alpha) * self.edge_reward
+        self.alpha = alpha
 
         # sort the list of edges from higher to lower efficiency
-        self.efficiency_list.sort(key = operator.attrgetter("efficiency"), reverse = True)
-        return self.efficiency_list
+        self._alive = np.ones(len(self.start), dtype=bool)
+        self._sort_arcs(np.arange(len(self.start)))
+        return self
+
+    def with_alpha(self, alpha: float):
+        """
+        Efficiency list of the same arcs for another alpha value. The efficiency is linear
+        in alpha, so only the (shared) savings and edge rewards are needed: no new arcs are generated.
+        """
+        index = np.flatnonzero(self._alive)
+        new = EfficiencyList.__new__(EfficiencyList)
+        new.__dict__.update(self.__dict__)
+        new.alpha = alpha
+        new._alive = self._alive.copy()
+        new.efficiency = alpha * self.savings + (1 - alpha) * self.edge_reward
+        # sort the edges from higher to lower efficiency
+        new._sort_arcs(index)
+        return new
+
+    def replan(self, start_node, visited_nodes, alpha: float = None):
+        """
+        Incremental version of generate for the remaining network of an emulation:
+        the arcs of the visited nodes (and of the new start depot) are masked out and
+        only the start-depot term of the savings is recomputed before sorting again.
+        The arc arrays are shared with this (generated) list, which is not modified.
+
+        :param start_node: node that becomes the start depot (current position).
+        :param visited_nodes: nodes already visited (removed from the network).
+        :param alpha: weight of the savings in the efficiency (defaults to the generation one).
+        :return: a new EfficiencyList whose nodes are [start_node, unvisited customers, end depot].
+        """
+        alpha = self.alpha if alpha is None else alpha
+        removed_nodes = np.zeros(len(self.geometry), dtype=bool)
+        removed_nodes[[node.id for node in visited_nodes]] = True
+        removed_nodes[start_node.id] = True
+        end_node = self.nodes[-1]
+
+        new = EfficiencyList.__new__(EfficiencyList)
+        new.__dict__.update(self.__dict__)
+        new.nodes = [start_node] + [node for node in self.nodes[1:-1] if not removed_nodes[node.id]] + [end_node]
+        new.alpha = alpha
+        new._alive = ~(removed_nodes[self.start] | removed_nodes[self.end])
+        index = np.flatnonzero(new._alive)
+        dist = self.geometry.matrix
+        new.savings = self.savings.copy()
+        new.savings[index] = dist[start_node.id, self.end[index]] + dist[self.start[index], end_node.id] - self.cost[index]
+        new.efficiency = self.efficiency.copy()
+        new.efficiency[index] = alpha * new.savings[index] + (1 - alpha) * self.edge_reward[index]
+        # sort the remaining edges from higher to lower efficiency
+        new._sort_arcs(index)
+        return new
+
+    def _discard_many(self, arc_indices):
+        """ Tombstone the arcs still in the list among arc_indices; return how many were removed """
+        arc_indices = arc_indices[self._alive[arc_indices]]
+        self._alive[arc_indices] = False
+        self._size -= len(arc_indices)
+        ranks = self._rank[arc_indices]
+        ranks = ranks[ranks >= 0]
+        self._sorted_size -= len(ranks)
+        if 32 * len(ranks) > len(self._tree):
+            # cheaper to rebuild the whole tree than to update it arc by arc
+            self._tree = [0] + self._tree_nodes(self._alive[self._order], 0).tolist()
+        else:
+            for rank in ranks.tolist():
+                self._tree_add(rank, -1)
+        return len(arc_indices)
+
+    def prune(self, route_max_cost: float, active_nodes=None, tolerance: float = 1e-9):
+        """
+        Remove the arcs (i, j) that can never be in a feasible route: those with
+        d(start, i) + d(i, j) + d(j, end) > route_max_cost (any route through the arc is at least
+        that long), and those of the nodes that are not active (e.g. nodes whose dummy route
+        is not feasible, which are in no route).
+
+        :return: number of arcs removed.
+        """
+        dist = self.geometry.matrix
+        start_id, end_id = self.nodes[0].id, self.nodes[-1].id
+        index = np.flatnonzero(self._alive)
+        start, end = self.start[index], self.end[index]
+        pruned = dist[start_id, start] + self.cost[index] + dist[end, end_id] > route_max_cost + tolerance
+        if active_nodes is not None:
+            active = np.zeros(len(self.geometry), dtype=bool)
+            active[[node.id for node in active_nodes]] = True
+            pruned |= ~(active[start] & active[end])
+        return self._discard_many(index[pruned])
+
+    def discard_below_savings(self, threshold: float):
+        """
+        Remove the arcs with savings lower than threshold, for a threshold that grows between calls.
+        The arcs left at the first call are swept by increasing savings, sorted lazily as the
+        threshold reaches them: the lowest ones are selected with argpartition in chunks that
+        double in size, so a call costs O(log n) plus O(1) per removed arc, plus the chunks sorted.
+
+        :return: number of arcs removed.
+        """
+        if threshold == np.inf:
+            return self._discard_many(np.flatnonzero(self._alive))
+        if self._savings_pool is None:
+            self._savings_pool = np.flatnonzero(self._alive)
+            self._savings_chunk = self._chunk_savings = np.empty(0)
+            self._savings_pointer = 0
+        removed = 0
+        while True:
+            pointer = int(np.searchsorted(self._chunk_savings, threshold, side="left"))
+            if pointer > self._savings_pointer:
+                removed += self._discard_many(self._savings_chunk[self._savings_pointer:pointer])
+                self._savings_pointer = pointer
+            if pointer < len(self._savings_chunk) or not len(self._savings_pool):
+                return removed
+            # the whole chunk is below the threshold: sort the next lowest savings of the pool
+            pool = self._savings_pool[self._alive[self._savings_pool]]
+            count = max(self.FIRST_CHUNK, 2 * len(self._savings_chunk))
+            if count < len(pool):
+                part = np.argpartition(self.savings[pool], count - 1)
+                chunk, self._savings_pool = pool[part[:count]], pool[part[count:]]
+            else:
+                chunk, self._savings_pool = pool, pool[:0]
+            self._savings_chunk = chunk[np.argsort(self.savings[chunk])]
+            self._chunk_savings = self.savings[self._savings_chunk]
+            self._savings_pointer = 0
 
     def remove_inverse(self, arc, verbose:bool=False):
-        if self.efficiency_list == []:
-            print("Empty efficiency list.")    
+        if self._size == 0:
+            logger.debug("Empty efficiency list.")
             return
-        for searched_arc in self.efficiency_list:
-            if searched_arc.end == arc.start and searched_arc.start == arc.end:
-                self.efficiency_list.remove(searched_arc)
-                if verbose:
-                    print(f"{searched_arc} removed from efficiency list.")
+        inverse_index = self._arc_index(arc.end.id, arc.start.id)
+        if inverse_index >= 0 and self._alive[inverse_index]:
+            self._discard(inverse_index)
+            if verbose:
+                logger.debug("Arc %s-%s removed from efficiency list.", arc.end.id, arc.start.id)
         return
 
-    def filter_node(self, node):
-        eff_list_copy = copy.copy(self.efficiency_list)
-        for arc in eff_list_copy:
-            if arc.start == node or arc.end == node:
-                self.efficiency_list.remove(arc)
-                # print(f"removing: {arc}")
-        return
+    def filter_node(self, node, outgoing: bool = True, incoming: bool = True):
+        """
+        Remove the arcs of a node (O(log n) per sorted arc removed): all of them, or only the arcs
+        leaving it (outgoing) or only the arcs reaching it (incoming).
+        :return: number of arcs removed.
+        """
+        p = self._position[node.id] if node.id < len(self._position) else -1
+        if p < 0:
+            return 0
+        # the arcs of customer p are those of the pairs (p, q), located arithmetically (dense list)
+        # or in the incidence structure (sparse list); arc 2k goes from low to high
+        m = self._n_customers
+        if self._pair_keys is None:
+            q = np.delete(np.arange(m), p)
+            low, high = np.minimum(p, q), np.maximum(p, q)
+            pair = low * m - low * (low + 1) // 2 + (high - low - 1)
+            is_low = low == p
+        else:
+            pair = self._incident[self._incident_ptr[p]:self._incident_ptr[p + 1]]
+            is_low = self._pair_keys[pair] // m == p
+        incident = []
+        if outgoing:
+            incident.append(2 * pair + ~is_low)
+        if incoming:
+            incident.append(2 * pair + is_low)
+        return self._discard_many(np.concatenate(incident))
 
 
-    def tune_alpha(self):
-        #TODO: extract as a function (outside the EfficiencyList class)
+    def tune_alpha(self, route_max_cost, alphas=None, n_br_runs: int = 0, refinements: int = 0,
+                   seed: int = None, workers: int = None, shared: bool = False):
         """
         tune the alpha value for generating enhanced savings
+        (see parallel.tune_alpha: the savings of this list are reused for every alpha)
+
+        :return: tuple (best alpha, initial solution obtained with it)
         """
-        best_reward = 0
-        eff_list = []
-        alpha = 0
-        for new_alpha in np.linspace(0, 1, 11):
-            new_effList = EfficiencyList(self.nodes).generate(alpha=new_alpha)
-            # new_effList = generateEfficiencyList(nodes, new_alpha)
-            # obtain a greedy solution (BR = False) for the current alpha value
-            # sol = merging(False, test, fleetSize, routeMaxCost, nodes, new_effList)
-            # if sol.reward > best_reward:
-                # best_reward = sol.reward
-                # eff_list = new_effList
-                # init_sol = sol 
-            return alpha
+        from parallel import tune_alpha  # parallel depends on this module
+        return tune_alpha(self, route_max_cost, alphas, n_br_runs, refinements, seed, workers, shared)
 
 
 if __name__ == "__main__":
@@ -111,7 +535,5 @@ if __name__ == "__main__":
 
     eff_list_05 = EfficiencyList(nodes).generate(alpha=0.5)
     eff_list_02 = EfficiencyList(nodes).generate(alpha=0.2)
-    max_05 = max(eff_list_05, key=operator.attrgetter("efficiency"))
-    max_02 = max(eff_list_02, key=operator.attrgetter("efficiency"))
-    print(max_05.efficiency)
-    print(max_02.efficiency)
\ No newline at end of file
+    print(eff_list_05.efficiency.max())
+    print(eff_list_02.efficiency.max())
\ No newline at end of file
@@ -1,41 +1,141 @@
 from typing import List, Dict, Union
 import math
+import copy
 import random
 
-from node import Node, euclidean_distance
+import numpy as np
+
+from node import Node
+from geometry import Geometry
+from logs import get_logger
+from metrics import timed
 from importer import Importer
 from efficiencylist import EfficiencyList
-from heuristic import pj_heuristic
+from heuristic import pj_heuristic, GreedySelector
+
+logger = get_logger(__name__)
 
 
 class Emulation:
-    def __init__(self, nodes: List[Node], max_cost:float):
+    def __init__(self, nodes: List[Node], max_cost:float, geometry: Geometry = None):
         """
         Represents the Emulation class that takes the network of nodes as input.
+        The state is kept in compact arrays: an id -> index map of the nodes, a visited mask
+        and the path (node ids) with its length, besides the cost and reward accumulators.
+        States can be saved and restored (snapshot/restore) and cheaply branched (fork).
 
         Args:
             nodes (List[Node]): List of Node instances.
+            max_cost (float): Maximum cost (budget) of the route.
+            geometry (Geometry): Precomputed distances of the network (computed if not provided).
         """
         self.nodes = nodes
         self.max_cost = max_cost
-        self.current_node: Node = next((node for node in self.nodes if node.id == 0), None)
-        self.path_covered: List[Node] = [self.current_node]
+        self.geometry = geometry if geometry is not None else Geometry(nodes)
+        self.eff_list: EfficiencyList = None  # efficiency list of the whole network (built on the first replan)
+        self.index_of: Dict[int, int] = {node.id: index for index, node in enumerate(nodes)}  # node id -> position in nodes
+        self.visited = np.zeros(len(self.geometry), dtype=bool)  # visited mask (by node id)
+        self.path = np.zeros(len(nodes) + 1, dtype=np.intp)  # ids of the nodes of the path covered
+        self.path_len: int = 0
+        self._owns_arrays = True  # False while the visited mask and path are shared with a fork
+        self.greedy_selector = GreedySelector(nodes, self.geometry, self.visited)  # index of the unvisited nodes for the greedy action
+        self.reset_emulator()
+
+    def reset_emulator(self):
+        """
+        Function to reset the emulator
+        """
+        self._own_arrays()
+        self.visited[:] = False
+        self.greedy_selector.reset()
+        self.current_node: Node = self.get_node(0)
+        self.path_len = 0
+        self._add_to_path(self.current_node)
         self.current_reward: float = 0.0
         self.current_cost: float = 0.0
         self.static_cost: float = 0.0
         self.parameters: List[float] = []
 
-    def reset_emulator(self):
+    def get_node(self, node_id: int) -> Node:
+        """ Node with the given id (None if there is none) """
+        index = self.index_of.get(node_id)
+        return self.nodes[index] if index is not None else None
+
+    def is_visited(self, node: Node) -> bool:
+        return bool(self.visited[node.id])
+
+    @property
+    def path_covered(self) -> List[Node]:
+        """ Nodes of the path covered (built from the path ids) """
+        return [self.nodes[self.index_of[node_id]] for node_id in self.path[:self.path_len].tolist()]
+
+    @path_covered.setter
+    def path_covered(self, path: List[Node]):
+        self._own_arrays()
+        self.visited[:] = False
+        self.greedy_selector.reset()
+        self.path_len = 0
+        for node in path:
+            self._add_to_path(node)
+        self.current_node = path[-1]
+
+    def _own_arrays(self):
+        """ Copy on write: copy the arrays shared with forks before modifying them """
+        if not self._owns_arrays:
+            self.visited = self.visited.copy()
+            self.path = self.path.copy()
+            self.greedy_selector.visited = self.visited
+            self._owns_arrays = True
+
+    def _add_to_path(self, node: Node):
+        if self.path_len == len(self.path):
+            self.path = np.concatenate((self.path, np.zeros(len(self.path), dtype=np.intp)))
+        self.path[self.path_len] = node.id
+        self.path_len += 1
+        self.greedy_selector.visit(node)  # also sets the visited mask
+
+    def snapshot(self) -> Dict:
+        """ Copy of the current state (see restore) """
+        return {
+            "path": self.path[:self.path_len].copy(),
+            "current_reward": self.current_reward,
+            "current_cost": self.current_cost,
+            "static_cost": self.static_cost,
+            "parameters": self.parameters,
+            "level_left": list(self.greedy_selector.level_left),
+            "top": self.greedy_selector.top,
+        }
+
+    def restore(self, snapshot: Dict):
+        """ Go back to a state saved with snapshot """
+        self._own_arrays()
+        self.visited[self.path[:self.path_len]] = False
+        path = snapshot["path"]
+        self.path_len = len(path)
+        if self.path_len > len(self.path):
+            self.path = np.zeros(self.path_len + len(self.nodes) + 1, dtype=np.intp)
+        self.path[:self.path_len] = path
+        self.visited[path] = True
+        self.current_node = self.get_node(int(path[-1]))
+        self.current_reward = snapshot["current_reward"]
+        self.current_cost = snapshot["current_cost"]
+        self.static_cost = snapshot["static_cost"]
+        self.parameters = snapshot["parameters"]
+        self.greedy_selector.level_left = list(snapshot["level_left"])
+        self.greedy_selector.top = snapshot["top"]
+
+    def fork(self) -> "Emulation":
         """
-        Function to reset the emulator
+        Branch of the current state: the fork shares the network data (nodes, geometry,
+        efficiency list, indexes) and, until one of them moves, the visited mask and path
+        (copy on write), so that many what-if continuations can start from one state.
         """
-        self.current_node = next((node for node in self.nodes if node.id == 0), None)
-        self.path_covered = [self.current_node]
-        self.current_reward = 0.0
-        self.current_cost = 0.0
-        self.static_cost = 0.0
-        self.parameters = []
-
+        new = Emulation.__new__(Emulation)
+        new.__dict__.update(self.__dict__)
+        new.greedy_selector = copy.copy(self.greedy_selector)
+        self._owns_arrays = False
+        new._owns_arrays = False
+        return new
 
     def get_current_state(self) -> Dict:
         """
@@ -63,6 +163,7 @@ class Emulation:
         self.parameters = params
         return 
 
+    @timed("emulation.step")
     def step(self, new_node_id: int) -> None:
         """
         Selects a new node from the list of nodes and moves to that node.
@@ -75,19 +176,19 @@ class Emulation:
             ValueError: If the provided new_node_id does not match any node in the list of nodes.
         """
         # Find the node with the given id in the list of nodes
-        new_node = next((node for node in self.nodes if node.id == new_node_id), None)
+        new_node = self.get_node(new_node_id)
 
         if new_node is None:
             raise ValueError("Invalid node id provided")
 
         if self.current_node is not None:
             # Calculate the distance between the current node and the new node
-            distance_static = euclidean_distance(self.current_node, new_node)
+            distance_static = self.geometry.distance(self.current_node, new_node)
             # params = dynamic_param()
-            dynamic_component = dynamic_function(self.parameters, len(self.path_covered))
+            dynamic_component = dynamic_function(self.parameters, self.path_len)
             distance_dynamic = distance_static + dynamic_component
-            print(f"{distance_static = }")
-            print(f"{distance_dynamic = }")
+            logger.debug("distance_static = %s", distance_static)
+            logger.debug("distance_dynamic = %s", distance_dynamic)
 
             # Update the current cost with the calculated distance
             self.current_cost += distance_dynamic
@@ -102,11 +203,12 @@ class Emulation:
         self.current_node = new_node
 
         # Add the new node to the path covered
-        self.path_covered.append(self.current_node)
+        self._own_arrays()
+        self._add_to_path(self.current_node)
     
     #TODO: verify that the solution is still feasible
 
-def dynamic_param(param_seed:int=1, n_param:int=4):
+def dynamic_param(param_seed:int=1, n_param:int=4, rng: random.Random = None):
     """
     Generate dynamic parameters
     By default consider 4 parameters for the function:
@@ -115,13 +217,24 @@ def dynamic_param(param_seed:int=1, n_param:int=4):
     3. day of the week
     4. state of charge
     (5. driver experience)
+    The parameters are drawn from rng if given (param_seed is then ignored), otherwise
+    from the global random generator seeded with param_seed.
     """
     params = []
-    random.seed(param_seed)
+    if rng is None:
+        random.seed(param_seed)
+        rng = random
     for i in range(n_param):
-        params.append(random.random())
+        params.append(rng.random())
     return params
 
+def dynamic_scenarios(n_scenarios: int, n_param: int = 4, seed=None):
+    """
+    Sample n_scenarios vectors of dynamic parameters (uniform in [0, 1), as dynamic_param)
+    from a local generator, as an (n_scenarios, n_param) array
+    """
+    return np.random.default_rng(seed).random((n_scenarios, n_param))
+
 def dynamic_function(parameters, tstep, variability:int=1):
     #TODO: add the start-end nodes as part of the dynamic_function?
     deltas = []
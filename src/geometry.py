@@ -0,0 +1,47 @@
+from typing import List
+
+import numpy as np
+
+from node import Node
+
+
+class Geometry:
+    ''' Instance-level geometry: node coordinates and the full distance matrix '''
+
+    def __init__(self, nodes: List[Node]) -> None:
+        """
+        Compute the n x n euclidean distance matrix of a network in a single vectorized pass.
+        Rows and columns are indexed by node id, so any subset of the original nodes
+        (e.g. the unvisited nodes during an emulation) can share the same Geometry.
+
+        :param nodes: list of Node objects of the whole instance.
+        """
+        size = max(node.id for node in nodes) + 1
+        self.x = np.zeros(size)
+        self.y = np.zeros(size)
+        self.reward = np.zeros(size)
+        ids = np.fromiter((node.id for node in nodes), dtype=np.intp, count=len(nodes))
+        self.x[ids] = [node.x for node in nodes]
+        self.y[ids] = [node.y for node in nodes]
+        self.reward[ids] = [node.reward for node in nodes]
+        # computed in place, so that large instances only need one extra n x n temporary
+        self.matrix = np.subtract.outer(self.x, self.x)
+        np.square(self.matrix, out=self.matrix)
+        dy = np.subtract.outer(self.y, self.y)
+        np.square(dy, out=dy)
+        self.matrix += dy
+        del dy
+        np.sqrt(self.matrix, out=self.matrix)
+
+    @classmethod
+    def from_arrays(cls, x: np.ndarray, y: np.ndarray, reward: np.ndarray, matrix: np.ndarray) -> "Geometry":
+        """ Geometry over existing arrays (e.g. in shared memory), indexed by node id, without copying them """
+        geometry = cls.__new__(cls)
+        geometry.x, geometry.y, geometry.reward, geometry.matrix = x, y, reward, matrix
+        return geometry
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def distance(self, node1: Node, node2: Node) -> float:
+        return float(self.matrix[node1.id, node2.id])
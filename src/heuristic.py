@@ -1,21 +1,31 @@
 import math
 import random
 import copy
+import heapq
 import operator
+import logging
+from collections import OrderedDict
 
-from node import euclidean_distance
+import numpy as np
+
+from logs import get_logger
+from metrics import metrics, timed
 from efficiencylist import EfficiencyList
+from geometry import Geometry
 from solution import Solution, dummy_solution
 from importer import Importer
 
-def getRandomPosition(size, beta1:float = 0.1, beta2:float = 0.3):
+logger = get_logger(__name__)
+
+def getRandomPosition(size, beta1:float = 0.1, beta2:float = 0.3, rng=random):
     """
     Gets a random position according to a Gemetric(beta)
+    The random numbers are drawn from rng (the global random module by default)
     """
     # randomly select a beta value between beta1 and beta2
     # the default values 0.1 and 0.3 were taken from the one used in Panadero et al.(2020)
-    beta = beta1 + random.random() * (beta2 - beta1)
-    index = int(math.log(random.random())/math.log(1 - beta))
+    beta = beta1 + rng.random() * (beta2 - beta1)
+    index = int(math.log(rng.random())/math.log(1 - beta))
     index = index % size
     return index
 
@@ -23,15 +33,15 @@ def checkMergingConditions(iNode, jNode, iRoute, jRoute, ijArc, routeMaxCost, ve
     """ Check if merging conditions are met """
     # condition 1: iRoute and jRoure are not the same route object
     if iRoute == jRoute:
-        if verbose: print("cannot merge routes: same routes")
+        if verbose: logger.debug("cannot merge routes: same routes")
         return False
     # condition 2.1: The route with the node(i) has to be linked to end
     if iRoute.is_linked_to_end(iNode) == False:
-        if verbose: print(f"cannot merge routes: {iNode}(i) not linked to end")
+        if verbose: logger.debug("cannot merge routes: %s(i) not linked to end", iNode)
         return False
     # condition 2.2: The route with the node(j) has to be linked to start
     if jRoute.is_linked_to_start(jNode) == False:
-        if verbose: print(f"cannot merge routes: {jNode}(j) not linked to start")
+        if verbose: logger.debug("cannot merge routes: %s(j) not linked to start", jNode)
         return False
     # condition 3: cost after merging does not exceed maxTime (or maxCost)
     # print(f"{routeMaxCost =}")
@@ -39,28 +49,74 @@ def checkMergingConditions(iNode, jNode, iRoute, jRoute, ijArc, routeMaxCost, ve
     # print(f"{jRoute=}, cost={jRoute.cost}")
     # print(f"{ijArc=}, savings={ijArc.savings}")
     if iRoute.cost + jRoute.cost - ijArc.savings > routeMaxCost:
-        if verbose: print("cannot merge routes: cost exceeded")
+        if verbose: logger.debug("cannot merge routes: cost exceeded")
         return False
     # else, merging is feasible
     return True
 
-def pj_heuristic(nodes, eff_list, routeMaxCost, useBR:bool=True, verbose:bool=False):
-    """ Perform the BR arc-selection & routing-merging iterative process """
-    sol = dummy_solution(nodes, routeMaxCost) # compute the dummy solution
+@timed("pj_heuristic")
+def pj_heuristic(nodes, eff_list, routeMaxCost, useBR:bool=True, verbose:bool=False, rng=random, prune:bool=None):
+    """
+    Perform the BR arc-selection & routing-merging iterative process
+    With useBR, the biased-randomized positions are drawn from rng (e.g. a random.Random(seed))
+    With prune (the default without BR), the arcs that cannot give a feasible merge are removed
+    from the list instead of being popped and rejected. The greedy solution does not change, but
+    the BR positions would be drawn among far fewer arcs, which lowers the BR rewards, so BR runs
+    do not prune unless asked to:
+        - before the loop, the arcs with d(start, i) + d(i, j) + d(j, end) > max cost and the arcs
+          of the nodes with an unfeasible dummy route
+        - after each merge through arc (i, j), the arcs leaving i and reaching j, since i is not
+          linked to the end depot anymore nor j to the start depot
+        - after each merge, the arcs with savings < c1 + c2 - max cost, where c1 <= c2 are the two
+          cheapest routes (any merge joins two routes); the loop ends when no arc is left
+    When a sparse list (see EfficiencyList) runs out with several routes left, the merges go on
+    with the arcs between the endpoints of these routes (EfficiencyList.sublist).
+    The number of arcs popped, merged and pruned is reported in sol.stats (and added to the
+    "pj.*" counters of metrics when it is enabled).
+    The merge loop is traced at DEBUG level (INFO level if verbose); the level is checked once,
+    so the trace costs nothing in the loop when the logger is disabled.
+    """
+    if prune is None:
+        prune = not useBR
+    trace_level = logging.INFO if verbose else logging.DEBUG
+    trace = logger.isEnabledFor(trace_level)
+    sol = dummy_solution(nodes, routeMaxCost, eff_list.geometry) # compute the dummy solution
     if len(sol.candidate_routes) == 0:
-        print("No candidate routes in dummy solution.")
+        logger.info("No candidate routes in dummy solution.")
         return None
     elif len(sol.candidate_routes) == 1:
-        print("Only one solution - no merge is possible")
+        logger.debug("Only one solution - no merge is possible")
         return sol
     effList = copy.copy(eff_list) # make a shallow copy of the effList since it will be modified
-    while len(effList) > 0: # list is not empty
+    stats = {"arcs": len(effList), "popped": 0, "merges": 0, "pruned_static": 0, "pruned_linked": 0, "pruned_bound": 0,
+             "fallback_arcs": 0}
+    if prune:
+        stats["pruned_static"] = effList.prune(routeMaxCost, sol.route_by_node.keys())
+        # min-heap of the route costs (entries of merged or removed routes are skipped lazily)
+        route_costs = [(route.cost, id(route), route) for route in sol.candidate_routes]
+        heapq.heapify(route_costs)
+    fallback = effList.is_sparse
+    while True:
+        if len(effList) == 0 and fallback and len(sol.candidate_routes) > 1:
+            # a sparse list has no arcs between the endpoints of many of the routes left:
+            # go on with the (dense) list of the arcs between the route endpoints
+            fallback = False
+            endpoints = set()
+            for route in sol.candidate_routes:
+                endpoints.update((route.first_node, route.last_node))
+            effList = effList.sublist([node for node in effList.nodes[1:-1] if node in endpoints])
+            stats["fallback_arcs"] = len(effList)
+            if prune:
+                stats["pruned_static"] += effList.prune(routeMaxCost)
+        if len(effList) == 0:
+            break
         position = 0
         if useBR == True:
-            position = getRandomPosition(len(effList))
+            position = getRandomPosition(len(effList), rng=rng)
         else:
             position = 0  # greedy behavior
         arc_i_j = effList.pop_arc(position) # select the next arc from the list
+        stats["popped"] += 1
         # determine the nodes i < j that define the arc
         node_i = arc_i_j.start
         node_j = arc_i_j.end
@@ -73,124 +129,316 @@ def pj_heuristic(nodes, eff_list, routeMaxCost, useBR:bool=True, verbose:bool=Fa
         if route_j is None:
             effList.filter_node(node_j)
             continue
-        if verbose:
-            print(f"*** NEW ARC ***")
-            print(f"efflist: {len(effList)}")
-            print(f"initial routes in sol: {len(sol.candidate_routes)}")
-            print(f"{arc_i_j =} -> Reward_start={arc_i_j.start.reward}, Cost={arc_i_j.cost}")
-            print(f"{arc_i_j =} -> Reward_end={arc_i_j.end.reward}, Cost={arc_i_j.cost}")
-            print(f"{route_i =} -> Reward={route_i.reward}, Cost={route_i.cost}")
-            print(f"{route_j =} -> Reward={route_j.reward}, Cost={route_j.cost}")
+        if trace:
+            logger.log(trace_level, "*** NEW ARC ***")
+            logger.log(trace_level, "efflist: %d", len(effList))
+            logger.log(trace_level, "initial routes in sol: %d", len(sol.candidate_routes))
+            logger.log(trace_level, "arc_i_j=%s -> Reward_start=%s, Cost=%s", arc_i_j, arc_i_j.start.reward, arc_i_j.cost)
+            logger.log(trace_level, "arc_i_j=%s -> Reward_end=%s, Cost=%s", arc_i_j, arc_i_j.end.reward, arc_i_j.cost)
+            logger.log(trace_level, "route_i=%s -> Reward=%s, Cost=%s", route_i, route_i.reward, route_i.cost)
+            logger.log(trace_level, "route_j=%s -> Reward=%s, Cost=%s", route_j, route_j.reward, route_j.cost)
         # print(f"efflist: {len(effList)}")
         # check if merge is possible
-        isMergeFeasible = checkMergingConditions(node_i, node_j, route_i, route_j, arc_i_j, routeMaxCost, verbose)
+        isMergeFeasible = checkMergingConditions(node_i, node_j, route_i, route_j, arc_i_j, routeMaxCost, trace)
         # if all necessary conditions are satisfied, merge and delete arc (j, i)
         if isMergeFeasible:
-            if verbose:
-                print(f"merging")
-            # route_i will contain arc (i, finish)
-            arc_i = route_i.arcs[-1] # arc_i is (i, finish)
-            route_i.remove_arc(arc_i) # node i will not be linked to finish depot anymore
-            # route_j will contain arc (start, j)
-            arc_j = route_j.arcs[0]
-            route_j.remove_arc(arc_j) # node j will not be linked to start depot anymore
-
-            # add arc_i_j to route_i
-            route_i.add_arc(arc_i_j)
-            # route_i.reward += node_j.reward
-
-            # add route_j to new route_i
-            for arc in route_j.arcs:
-                route_i.add_arc(arc)
-                # route_i.reward += arc.end.reward
-            if verbose:
-                print(f"{route_i =} -> Reward={route_i.reward}, Cost={route_i.cost}")
-
-            # delete route_j from emerging solution
-            sol.remove_route(route_j)
+            if trace:
+                logger.log(trace_level, "merging")
+            # merge route_j into route_i through arc (i, j) and delete route_j from emerging solution
+            sol.merge_routes(route_i, route_j, arc_i_j)
+            stats["merges"] += 1
+            if trace:
+                logger.log(trace_level, "route_i=%s -> Reward=%s, Cost=%s", route_i, route_i.reward, route_i.cost)
 
             # if still in list, delete arc (j, i) since it will not be used
-            effList.remove_inverse(arc_i_j, verbose)
+            effList.remove_inverse(arc_i_j, trace)
+            if prune:
+                stats["pruned_linked"] += effList.filter_node(node_i, incoming=False) + effList.filter_node(node_j, outgoing=False)
+                stats["pruned_bound"] += prune_by_route_costs(sol, effList, route_costs, route_i, routeMaxCost)
 
-        if verbose:
-            print(f"n routes in sol: {len(sol.candidate_routes)}")
+        if trace:
+            logger.log(trace_level, "n routes in sol: %d", len(sol.candidate_routes))
             for route in sol.candidate_routes:
-                print(f"* {route}")
+                logger.log(trace_level, "* %s", route)
 
     # sort the list of routes in sol by reward and cost
     sol.candidate_routes.sort(key = operator.attrgetter("cost"), reverse = False)
     sol.candidate_routes.sort(key = operator.attrgetter("reward"), reverse = True)
-    print("*** Routes after merging ***")
-    for route in sol.candidate_routes:
-        print(f"* {route} -> Reward={route.reward}, Cost={route.cost}")
+    sol.stats = stats
+    logger.debug("PJ stats: %s", stats)
+    if metrics.enabled:
+        metrics.count("pj.runs")
+        for name, value in stats.items():
+            metrics.count(f"pj.{name}", value)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("*** Routes after merging ***")
+        for route in sol.candidate_routes:
+            logger.debug("* %s -> Reward=%s, Cost=%s", route, route.reward, route.cost)
 
     return sol
 
-def generate_new_route(emulation, verbose:bool=False) -> Solution:
+def prune_by_route_costs(sol, effList, route_costs, merged_route, routeMaxCost, tolerance: float = 1e-9):
+    """
+    Update the heap of route costs after merged_route changed, and remove from effList the arcs
+    whose savings cannot compensate the two cheapest routes (see pj_heuristic).
+    :return: number of arcs removed.
+    """
+    heapq.heappush(route_costs, (merged_route.cost, id(merged_route), merged_route))
+    cheapest = []
+    while route_costs and len(cheapest) < 2:
+        cost, key, route = heapq.heappop(route_costs)
+        # skip the stale entries: merged (removed) routes and old costs of merged_route
+        if sol.route_by_node.get(route.first_node) is route and cost == route.cost and all(key != k for _, k, _ in cheapest):
+            cheapest.append((cost, key, route))
+    for entry in cheapest:
+        heapq.heappush(route_costs, entry)
+    if len(cheapest) < 2:
+        return effList.discard_below_savings(np.inf) # a single route is left: no merge is possible
+    return effList.discard_below_savings(cheapest[0][0] + cheapest[1][0] - routeMaxCost - tolerance)
+
+class ReplanCache:
+    """
+    Bounded LRU cache of PJ replans (generate_new_route) for one instance and efficiency list.
+    A replan is keyed by the current node, the visited nodes (bitmask) and the remaining
+    budget rounded down to a multiple of bucket_size (exact budget if bucket_size is None),
+    and it is solved with that rounded-down budget, so cached routes are always feasible.
+    The cached solutions are shared by the callers that hit them.
+    """
+    # approximate memory of an entry and of each arc of its solution (bytes)
+    ENTRY_BYTES = 512
+    ARC_BYTES = 160
+
+    def __init__(self, bucket_size: float = 1.0, max_entries: int = 4096, max_bytes: int = None) -> None:
+        """
+        :param bucket_size: width of the remaining budget buckets (None for exact budgets).
+        :param max_entries: maximum number of cached replans.
+        :param max_bytes: maximum (approximate) memory of the cached replans, unbounded if None.
+        """
+        self.bucket_size = bucket_size
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (solution, size), least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def budget(self, remaining_budget: float) -> float:
+        """ Budget used to solve (and key) a replan with the given remaining budget """
+        if self.bucket_size is None:
+            return remaining_budget
+        return math.floor(remaining_budget / self.bucket_size) * self.bucket_size
+
+    def key(self, emulation, remaining_budget: float, alpha: float):
+        visited = np.packbits(emulation.visited).tobytes()
+        return (emulation.current_node.id, visited, self.budget(remaining_budget), alpha)
+
+    def lookup(self, key):
+        """ Return (True, cached solution) on a hit, (False, None) on a miss """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[0]
+
+    def store(self, key, solution: Solution):
+        n_arcs = sum(len(route.arcs) for route in solution.candidate_routes) if solution else 0
+        size = self.ENTRY_BYTES + len(key[1]) + n_arcs * self.ARC_BYTES
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (solution, size)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes and len(self._entries) > 1):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+        }
+
+
+@timed("generate_new_route")
+def generate_new_route(emulation, eff_list: EfficiencyList = None, alpha: float = 0.5, verbose:bool=False,
+                       cache: ReplanCache = None, local_search=None, rng: random.Random = None) -> Solution:
     """
     Given the current status (emulation network, current position, route covered)
     generate a new route to the end position based on the the selected heuristic
     (with the PJ's heuristic the new routes are always feasible)
+
+    The efficiency list of the remaining network is derived incrementally from the
+    efficiency list of the whole network (eff_list, or the one cached in the emulation)
+    With a ReplanCache, repeated replans are answered from the cache (see ReplanCache)
+    With a LocalSearch, the best route of the new solution is improved (2-opt, or-opt and
+    insertion of the unvisited nodes) before it is returned
+    With rng, the PJ heuristic is biased-randomized (positions drawn from rng) and the cache,
+    which only holds greedy replans, is not used
     """
-    #TODO: function to clean up the efficiency list
-    #   - parameter to clean also the inverse arc
-    new_nodes = copy.copy(emulation.nodes) # create a shallow copy of the emulation nodes
-    for visited_node in emulation.path_covered[:-1]:
-        new_nodes.remove(visited_node) # remove the already visited nodes
-    new_eff_list = EfficiencyList(new_nodes)
-    new_eff_list.generate(alpha=0.5) # calculate a new efficiency list
+    if rng is not None:
+        cache = None
+    if eff_list is None:
+        if emulation.eff_list is None:
+            emulation.eff_list = EfficiencyList(emulation.nodes, emulation.geometry).generate(alpha=alpha)
+        eff_list = emulation.eff_list
     new_max_cost = emulation.get_initial_conditions()["initial_max_cost"] - emulation.static_cost
+    if cache is not None:
+        key = cache.key(emulation, new_max_cost, alpha)
+        hit, new_solution = cache.lookup(key)
+        metrics.count("replan_cache.hits" if hit else "replan_cache.misses")
+        if hit:
+            return new_solution
+        new_max_cost = key[2]
+    metrics.count("replans")
+    # mask out the already visited nodes and move the start depot to the current node
+    new_eff_list = eff_list.replan(emulation.current_node, emulation.path_covered[:-1], alpha=alpha)
     # generate a new solution using the PJ's algrorithm
-    emulation.path_covered[-1].is_start = True # make final node in path the starting node
-    if dummy_solution(new_nodes, new_max_cost):
-        new_solution = pj_heuristic(new_nodes, new_eff_list, new_max_cost, useBR=False, verbose=verbose)
-    emulation.path_covered[-1].is_start = False # final node in covered path is not the starting node
+    was_start = emulation.current_node.is_start
+    emulation.current_node.is_start = True # make final node in path the starting node
+    new_solution = pj_heuristic(new_eff_list.nodes, new_eff_list, new_max_cost, useBR=rng is not None, verbose=verbose,
+                                rng=rng)
+    emulation.current_node.is_start = was_start # restore the flag (the path starts at the start depot)
+    if local_search is not None and new_solution is not None:
+        local_search.improve_solution(new_solution, new_max_cost, new_eff_list.nodes[1:-1])
+    if cache is not None:
+        cache.store(key, new_solution)
 
     return new_solution
 
+class GreedySelector:
+    """
+    Index of the unvisited customers (with a positive reward) used by the greedy action.
+    Customers are grouped by reward level, and the levels are kept sorted (highest first)
+    with a pointer past the levels that are already fully visited, so that the max-reward
+    selection only looks at the best level(s) with a feasible node, vectorized with NumPy.
+    A node is feasible if dist(current, node) + dist(node, end) fits in the remaining budget.
+
+    Feasibility depends on the current node and budget, so it is not indexed: a "reward" selection
+    costs O(L + m), with L the levels up to the first one with a feasible node and m their customers.
+    This is O(n) at worst (e.g. when no feasible customer is left, at the end of each route).
+    The "efficiency" key depends on the current node too, so it is an O(n) vectorized scan, and
+    top_k is an O(n log n) sort of the feasible customers.
+    """
+    def __init__(self, nodes, geometry: Geometry, visited: np.ndarray = None) -> None:
+        """
+        :param visited: visited mask (by node id) to share with the owner of the index (e.g. an Emulation).
+        """
+        self.geometry = geometry
+        self.end_node = next(node for node in nodes if node.is_end)
+        self.node_by_id = {node.id: node for node in nodes}
+        customers = [node for node in nodes if not node.is_start and not node.is_end and node.reward > 0]
+        ids = np.array([node.id for node in customers], dtype=np.intp)
+        rewards = geometry.reward[ids]
+        self.levels = np.unique(rewards)[::-1] # reward levels, highest first
+        self.level_ids = [ids[rewards == reward] for reward in self.levels] # customers of each level
+        self.level_of = {node_id: level for level, level_ids in enumerate(self.level_ids) for node_id in level_ids.tolist()}
+        self.customer_ids = ids
+        self.visited = visited if visited is not None else np.zeros(len(geometry), dtype=bool)
+        self.reset()
+
+    def reset(self):
+        self.visited[:] = False
+        self.level_left = [len(level_ids) for level_ids in self.level_ids] # unvisited customers per level
+        self.top = 0 # first level with unvisited customers
+
+    def __copy__(self):
+        """ Copies share the static index and the visited mask, but not the level counts """
+        new = GreedySelector.__new__(GreedySelector)
+        new.__dict__.update(self.__dict__)
+        new.level_left = list(self.level_left)
+        return new
+
+    def visit(self, node):
+        """ Keep the index up to date when a node is visited """
+        if self.visited[node.id]:
+            return
+        self.visited[node.id] = True
+        level = self.level_of.get(node.id)
+        if level is not None:
+            self.level_left[level] -= 1
+            while self.top < len(self.levels) and self.level_left[self.top] == 0:
+                self.top += 1
+
+    def feasible(self, current_node, ids, remaining_budget):
+        dist = self.geometry.matrix
+        return ~self.visited[ids] & (dist[current_node.id, ids] + dist[ids, self.end_node.id] <= remaining_budget)
+
+    def top_k(self, current_node, remaining_budget: float, k: int, key: str = "reward"):
+        """
+        The k best feasible customers for the greedy key (see select), best first (O(n log n)).
+        """
+        dist = self.geometry.matrix
+        ids = self.customer_ids[self.feasible(current_node, self.customer_ids, remaining_budget)]
+        if key == "reward":
+            order = np.lexsort((dist[current_node.id, ids], -self.geometry.reward[ids]))
+        elif key == "efficiency":
+            efficiency = self.geometry.reward[ids] / np.maximum(dist[current_node.id, ids], 1e-12)
+            order = np.argsort(-efficiency, kind="stable")
+        else:
+            raise ValueError(f"Invalid greedy key: {key}")
+        return [self.node_by_id[node_id] for node_id in ids[order[:k]].tolist()]
+
+    def select(self, current_node, remaining_budget: float, key: str = "reward"):
+        """
+        Select the next node of the greedy action.
+
+        :param current_node: current position.
+        :param remaining_budget: budget left (the route must still be able to reach the end depot).
+        :param key: "reward" (max reward, ties broken by the distance to the current node)
+            or "efficiency" (max reward per distance from the current node).
+            See the class docstring for the cost of each key (O(n) at worst for both).
+        :return: the selected node, or the end depot if no feasible customer is left.
+        """
+        dist = self.geometry.matrix
+        if key == "reward":
+            for level in range(self.top, len(self.levels)):
+                if self.level_left[level] == 0:
+                    continue
+                ids = self.level_ids[level]
+                feasible = self.feasible(current_node, ids, remaining_budget)
+                if feasible.any():
+                    ids = ids[feasible]
+                    return self.node_by_id[int(ids[np.argmin(dist[current_node.id, ids])])]
+        elif key == "efficiency":
+            ids = self.customer_ids[self.feasible(current_node, self.customer_ids, remaining_budget)]
+            if len(ids):
+                efficiency = self.geometry.reward[ids] / np.maximum(dist[current_node.id, ids], 1e-12)
+                return self.node_by_id[int(ids[np.argmax(efficiency)])]
+        else:
+            raise ValueError(f"Invalid greedy key: {key}")
+        return self.end_node
+
 def find_max_reward_node(emulation):
     """
     Function to find the node with the max reward for a given emulation (with its current status)
-    TODO: change to max efficiency node (balance between reward and distance)
-    TODO: add a control to make the route feasible and to end the route if not feasible
-    """
-    candidate_nodes = list(set(emulation.nodes).difference(emulation.path_covered))
-    max_reward = 0
-    dist_cost = float("inf")
-    for node in candidate_nodes:
-        if node.reward > max_reward:
-            max_reward = node.reward
-            max_reward_node = node
-            dist_cost = euclidean_distance(emulation.current_node, node)
-        elif node.reward == max_reward:
-            new_cost_dist = euclidean_distance(emulation.current_node, node)
-            if new_cost_dist < dist_cost:
-                max_reward = node.reward
-                max_reward_node = node
-                dist_cost = new_cost_dist
-    return max_reward_node
+    Only nodes from which the end depot can still be reached within the remaining budget are
+    considered; the end depot is returned (to end the route) if there are none.
+    """
+    remaining_budget = emulation.max_cost - emulation.current_cost
+    return emulation.greedy_selector.select(emulation.current_node, remaining_budget, key="reward")
 
 def find_max_eff_node(emulation):
     """
-    Function to find the node with the max efficiency for a given emulation (with its current status)
-    TODO: change to max efficiency node (balance between reward and distance)
-    TODO: add a control to make the route feasible and to end the route if not feasible
-    """
-    candidate_nodes = list(set(emulation.nodes).difference(emulation.path_covered))
-    max_reward = 0
-    dist_cost = float("inf")
-    for node in candidate_nodes:
-        if node.reward > max_reward:
-            max_reward = node.reward
-            max_reward_node = node
-            dist_cost = euclidean_distance(emulation.current_node, node)
-        elif node.reward == max_reward:
-            new_cost_dist = euclidean_distance(emulation.current_node, node)
-            if new_cost_dist < dist_cost:
-                max_reward = node.reward
-                max_reward_node = node
-                dist_cost = new_cost_dist
-    return max_reward_node
+    Function to find the node with the max efficiency (reward per distance from the current node)
+    for a given emulation (with its current status), with the same feasibility control as find_max_reward_node
+    """
+    remaining_budget = emulation.max_cost - emulation.current_cost
+    return emulation.greedy_selector.select(emulation.current_node, remaining_budget, key="efficiency")
 
 
 if __name__ == "__main__":
@@ -1,74 +1,102 @@
 import os
-from typing import List, Optional
+import glob
+from typing import Dict, List, Optional
+
+import numpy as np
 
 from node import Node, euclidean_distance
+from logs import get_logger
+from metrics import timed
+
+logger = get_logger(__name__)
 
 
 class Importer:
-    def __init__(self, file_path: str) -> None:
+    def __init__(self, file_path: str, use_cache: bool = False, cache_dir: str = None) -> None:
         """
         Initializes the Importer object.
 
         :param file_path: The path to the input file.
+        :param use_cache: Keep a binary (.npz) copy of the parsed instance, reused while the source file is unchanged.
+        :param cache_dir: Directory of the cached files (next to the input file by default).
         """
         self.file_path = file_path
-        self.data = self.read_input_file()
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        self.Tmax, self.P, self.data = self.read_input_file()
         self.Tmax, self.P, self.node_data = self.read_nodes()
 
-    def read_input_file(self) -> List[str]:
+    def cache_path(self) -> str:
+        """ Path of the binary cache of the input file """
+        directory = self.cache_dir or os.path.dirname(self.file_path)
+        return os.path.join(directory, os.path.basename(self.file_path) + ".npz")
+
+    @timed("importer.read_input_file")
+    def read_input_file(self) -> tuple[float, int, np.ndarray]:
         """
-        Reads the input file and returns its content as a list of lines.
+        Reads the input file: the first line holds Tmax and P, the following ones "x y score".
+        The node lines are parsed in a single array load, or loaded from the binary cache
+        when it is enabled and was written for the current version (size and mtime) of the file.
 
-        :return: A list of lines in the input file.
+        :return: A tuple containing Tmax (float), P (int) and the (n, 3) array of node lines.
         """
         try:
-            with open(self.file_path, 'r') as file:
-                lines = file.readlines()
-            print(f"Instance: {os.path.basename(self.file_path)}")
-            return lines
+            stat = os.stat(self.file_path)
         except FileNotFoundError:
-            print("File not found.")
-            return []
+            logger.error("File not found: %s", self.file_path)
+            return None, None, np.empty((0, 3))
+        logger.info("Instance: %s", os.path.basename(self.file_path))
+        source = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+        if self.use_cache:
+            try:
+                with np.load(self.cache_path()) as cached:
+                    if np.array_equal(cached["source"], source):
+                        header = cached["header"]
+                        return float(header[0]), int(header[1]), cached["data"]
+            except (OSError, KeyError, ValueError):
+                pass # no valid cache: parse the text file
+
+        with open(self.file_path, 'r') as file:
+            first_line_data = file.readline().split()
+            data = np.loadtxt(file, ndmin=2, usecols=(0, 1, 2))
+        Tmax: float = float(first_line_data[0])
+        P: int = int(first_line_data[1])
+
+        if self.use_cache:
+            try:
+                os.makedirs(os.path.dirname(self.cache_path()) or ".", exist_ok=True)
+                with open(self.cache_path(), "wb") as file:
+                    np.savez(file, header=np.array([Tmax, P]), data=data, source=source)
+            except OSError as error:
+                logger.warning("Instance cache not written: %s", error)
+        return Tmax, P, data
 
+    @timed("importer.read_nodes")
     def read_nodes(self) -> tuple[float, int, List[Node]]:
         """
         Parses the input data and extracts information about nodes.
+        The first line of data is the start depot (id 0), the second one the end depot
+        (last id) and the rest are the customers (ids 1, 2, ...), so nodes are built sorted by id.
 
         :return: A tuple containing Tmax (float), P (int), and a list of Node objects.
         """
-        print("Reading nodes...")
+        logger.debug("Reading nodes...")
         node_data: List[Node] = []
-        # Extract Tmax and P from the first line
-        first_line_data = self.data[0].strip().split()
-        Tmax: float = float(first_line_data[0])
-        P: int = int(first_line_data[1])
-        if P != 1:
-            print("This is not an OP instance")
-            return Tmax, P, node_data
-
-        # Extract the first
-        x, y, score = map(float, self.data[1].strip().split())
-        instance = Node(0, x, y, score, is_start=True)
-        node_data.append(instance)
-        
-        # Extract last node
-        N = len(self.data) - 2
-        x, y, score = map(float, self.data[2].strip().split())
-        instance = Node(N, x, y, score, is_end=True)
-        node_data.append(instance)
-
-        # Extract data for each node starting from the fourth line
-        for i, line in enumerate(self.data[3:]):
-            x, y, score = map(float, line.strip().split())
-            instance = Node(i+1, x, y, score)
-            node_data.append(instance)
-
-        # Sort by node id
-        node_data.sort(key=lambda x: x.id)
-        print(f"Nodes read: {len(node_data)}")
-        print(f"MaxCost={Tmax}")
-
-        return Tmax, P, node_data
+        if self.P != 1:
+            if self.P is not None:
+                logger.warning("This is not an OP instance")
+            return self.Tmax, self.P, node_data
+
+        N = len(self.data) - 1
+        x, y, score = self.data.T.tolist()
+        node_data.append(Node(0, x[0], y[0], score[0], is_start=True))
+        node_data.extend(Node(i, x[i+1], y[i+1], score[i+1]) for i in range(1, N))
+        node_data.append(Node(N, x[1], y[1], score[1], is_end=True))
+        logger.info("Nodes read: %d", len(node_data))
+        logger.info("MaxCost=%s", self.Tmax)
+
+        return self.Tmax, self.P, node_data
 
     def print_nodes(self) -> None:
         """
@@ -82,6 +110,21 @@ class Importer:
             print(f"{node} (x={node.x}, y={node.y}), Score: {node.reward}")
 
 
+def load_directory(directory: str, pattern: str = "*.txt", use_cache: bool = False, cache_dir: str = None) -> Dict[str, Importer]:
+    """
+    Load all the instance files of a directory (e.g. "input/ref/Tsiligirides 3/").
+
+    :param directory: directory of the instance files.
+    :param pattern: glob pattern of the instance files.
+    :param use_cache: use the binary cache of each file (see Importer), preferably with a cache_dir
+        outside the dataset folders.
+    :param cache_dir: directory of the cached files (next to each input file by default).
+    :return: dictionary file name -> Importer, sorted by file name.
+    """
+    file_paths = sorted(glob.glob(os.path.join(glob.escape(directory), pattern)))
+    return {os.path.basename(path): Importer(path, use_cache, cache_dir) for path in file_paths}
+
+
 if __name__ == "__main__":
     # file_path = "input/ref/set_64_1/set_64_1_15.txt"
     # file_path = "input/ref/Tsiligirides 3/tsiligirides_problem_3_budget_070.txt"
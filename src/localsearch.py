@@ -0,0 +1,197 @@
+from typing import List
+
+import numpy as np
+
+from node import Node
+from arc import Arc
+from route import Route
+from geometry import Geometry
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# minimum improvement of a move (avoids cycling on floating point noise)
+EPSILON = 1e-9
+
+
+class LocalSearch:
+    """
+    Post-optimization of a route (e.g. the best route of a PJ solution): 2-opt and or-opt moves
+    shorten the route to free budget, then unvisited nodes are greedily inserted (best
+    reward / added cost first) while the route fits in the max cost; repeated until no
+    node can be inserted.
+    Moves work on the sequence of node ids with O(1) delta evaluation on the distance
+    matrix, and only consider new edges to the k nearest neighbours of a node.
+    """
+    def __init__(self, nodes: List[Node], geometry: Geometry = None, k: int = 10, max_rounds: int = 10,
+                 max_segment: int = 3) -> None:
+        """
+        :param nodes: list of nodes of the instance.
+        :param geometry: distances of the instance (computed if not provided).
+        :param k: size of the nearest neighbour candidate lists.
+        :param max_rounds: maximum number of improvement + insertion rounds.
+        :param max_segment: longest segment moved by or-opt.
+        """
+        self.geometry = geometry if geometry is not None else Geometry(nodes)
+        self.node_by_id = {node.id: node for node in nodes}
+        self.max_rounds = max_rounds
+        self.max_segment = max_segment
+        dist = self.geometry.matrix
+        k = min(k, len(dist) - 1)
+        # k nearest neighbours of each node (by id), closest first
+        nearest = np.argpartition(dist, k, axis=1)[:, :k + 1]
+        nearest = np.take_along_axis(nearest, np.argsort(np.take_along_axis(dist, nearest, axis=1), axis=1), axis=1)
+        self.neighbors = [[int(j) for j in row if j != i][:k] for i, row in enumerate(nearest)]
+
+    def improve(self, route: Route, max_cost: float, candidates: List[Node] = None) -> Route:
+        """
+        Improve a route (not modified) without exceeding max_cost.
+
+        :param route: route from its start depot to its end depot.
+        :param max_cost: maximum cost of the route.
+        :param candidates: nodes that may be inserted in the route (those already in it are ignored).
+        :return: a new route, with a cost lower or equal or with a higher reward.
+        """
+        dist = self.geometry.matrix
+        seq = list(route.get_nodes())
+        cost = float(dist[seq[:-1], seq[1:]].sum())
+        in_route = set(seq)
+        pending = np.array([node.id for node in candidates or [] if node.id not in in_route and node.reward > 0],
+                           dtype=np.intp)
+        for _ in range(self.max_rounds):
+            cost += self._two_opt(seq)
+            cost += self._or_opt(seq)
+            inserted, cost, pending = self._insert(seq, cost, max_cost, pending)
+            if not inserted:
+                break
+
+        new_route = Route()
+        for start_id, end_id in zip(seq[:-1], seq[1:]):
+            new_route.add_arc(Arc(self.node_by_id[start_id], self.node_by_id[end_id], self.geometry))
+        logger.debug("Local search: %s (%.2f, %.2f) -> %s (%.2f, %.2f)", route, route.reward, route.cost,
+                     new_route, new_route.reward, new_route.cost)
+        return new_route
+
+    def improve_solution(self, solution, max_cost: float, candidates: List[Node] = None):
+        """ Replace the best route of the solution by its improved version (see improve) """
+        best_route = solution.get_best_route()
+        if best_route is None:
+            return solution
+        new_route = self.improve(best_route, max_cost, candidates)
+        solution.remove_route(best_route)
+        solution.add_route(new_route)
+        return solution
+
+    def _two_opt(self, seq: List[int]) -> float:
+        """
+        First-improvement 2-opt on seq (in place): edges (seq[p], seq[p+1]) and (seq[q], seq[q+1])
+        are replaced by (seq[p], seq[q]) and (seq[p+1], seq[q+1]), one of which joins a node to one
+        of its nearest neighbours. The depots stay at both ends.
+        :return: change of the cost of the route (<= 0).
+        """
+        dist = self.geometry.matrix
+        neighbors = self.neighbors
+        pos = {node_id: i for i, node_id in enumerate(seq)}
+        last = len(seq) - 1
+        total = 0.0
+        improved = True
+        while improved:
+            improved = False
+            for i in range(last):
+                a, succ = seq[i], seq[i + 1]
+                d_a_succ = dist[a, succ]
+                for c in neighbors[a]:
+                    d_ac = dist[a, c]
+                    if d_ac >= d_a_succ:
+                        break # no gain is possible with farther neighbours
+                    j = pos.get(c)
+                    if j is None or j >= last or abs(j - i) < 2:
+                        continue
+                    p, q = min(i, j), max(i, j)
+                    delta = dist[seq[p], seq[q]] + dist[seq[p + 1], seq[q + 1]] - dist[seq[p], seq[p + 1]] - dist[seq[q], seq[q + 1]]
+                    if delta < -EPSILON:
+                        seq[p + 1:q + 1] = seq[p + 1:q + 1][::-1]
+                        for position in range(p + 1, q + 1):
+                            pos[seq[position]] = position
+                        total += delta
+                        improved = True
+                        break
+                if improved:
+                    break
+        return total
+
+    def _or_opt(self, seq: List[int]) -> float:
+        """
+        First-improvement or-opt on seq (in place): a segment of 1 to max_segment customers is moved,
+        in either orientation, next to a nearest neighbour of one of its ends.
+        :return: change of the cost of the route (<= 0).
+        """
+        dist = self.geometry.matrix
+        neighbors = self.neighbors
+        total = 0.0
+        improved = True
+        while improved:
+            improved = False
+            pos = {node_id: i for i, node_id in enumerate(seq)}
+            last = len(seq) - 1
+            for length in range(1, self.max_segment + 1):
+                for i in range(1, last - length + 1):
+                    s0, s1 = seq[i], seq[i + length - 1]
+                    prev, nxt = seq[i - 1], seq[i + length]
+                    gain = dist[prev, s0] + dist[s1, nxt] - dist[prev, nxt]
+                    if gain <= EPSILON:
+                        continue
+                    best = None
+                    for u in neighbors[s0] + neighbors[s1]:
+                        j = pos.get(u)
+                        if j is None or i <= j < i + length:
+                            continue
+                        # edges (u, successor) and (predecessor, u) outside the segment
+                        for left, right in ((j, j + 1), (j - 1, j)):
+                            if left < 0 or right > last or i - 1 <= left < i + length:
+                                continue
+                            x, y = seq[left], seq[right]
+                            for first, second in ((s0, s1), (s1, s0)):
+                                delta = dist[x, first] + dist[second, y] - dist[x, y] - gain
+                                if delta < -EPSILON and (best is None or delta < best[0]):
+                                    best = (delta, left, first == s1)
+                    if best is not None:
+                        delta, left, reverse = best
+                        segment = seq[i:i + length]
+                        if reverse:
+                            segment.reverse()
+                        rest = seq[:i] + seq[i + length:]
+                        insert_at = left + 1 if left < i else left + 1 - length
+                        seq[:] = rest[:insert_at] + segment + rest[insert_at:]
+                        total += delta
+                        improved = True
+                        break
+                if improved:
+                    break
+        return total
+
+    def _insert(self, seq: List[int], cost: float, max_cost: float, pending: np.ndarray):
+        """
+        Greedily insert pending nodes at their cheapest position, best reward / added cost first,
+        while the route fits in max_cost.
+        :return: tuple (number of inserted nodes, new cost, nodes still pending).
+        """
+        dist = self.geometry.matrix
+        reward = self.geometry.reward
+        inserted = 0
+        while len(pending):
+            route = np.array(seq, dtype=np.intp)
+            # added cost of each pending node (rows) at each edge of the route (columns)
+            added = dist[np.ix_(pending, route[:-1])] + dist[np.ix_(pending, route[1:])] - dist[route[:-1], route[1:]]
+            best_edge = added.argmin(axis=1)
+            best_added = added[np.arange(len(pending)), best_edge]
+            feasible = cost + best_added <= max_cost
+            if not feasible.any():
+                break
+            ratio = np.where(feasible, reward[pending] / np.maximum(best_added, EPSILON), -np.inf)
+            k = int(np.argmax(ratio))
+            seq.insert(int(best_edge[k]) + 1, int(pending[k]))
+            cost += float(best_added[k])
+            pending = np.delete(pending, k)
+            inserted += 1
+        return inserted, cost, pending
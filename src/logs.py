@@ -0,0 +1,29 @@
+import logging
+
+# all the loggers of the framework are children of this one
+LOGGER_NAME = "slh"
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Logger of a module of the framework (e.g. get_logger(__name__)).
+    Nothing below WARNING is emitted unless set_log_level is called, and messages use
+    lazy %-formatting, so disabled records cost a level check only.
+    """
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def set_log_level(level=logging.INFO, fmt: str = "%(name)s %(levelname)s: %(message)s") -> logging.Logger:
+    """
+    Set the level of the framework loggers, adding a stderr handler the first time.
+
+    :param level: logging level (e.g. logging.DEBUG to trace the merge loop and emulation steps).
+    :param fmt: format of the log records.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(fmt))
+        logger.addHandler(handler)
+    logger.setLevel(level)
+    return logger
@@ -0,0 +1,160 @@
+import sys
+import time
+import json
+import pstats
+import cProfile
+import functools
+import contextlib
+import tracemalloc
+from typing import Dict
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+
+class Metrics:
+    """
+    Counters and per-phase timers of the framework (one registry per process, see `metrics`).
+    Collection is off by default: the instrumented functions (see timed) and count then only
+    check the enabled flag.
+    Timers are inclusive (e.g. "pj_heuristic" is part of "generate_new_route").
+    """
+    def __init__(self) -> None:
+        self.enabled = False
+        self.counters = {}  # name -> count
+        self.timers = {}  # name -> [calls, total seconds]
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+        return self
+
+    def reset(self):
+        self.counters = {}
+        self.timers = {}
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name: str, seconds: float, calls: int = 1):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [calls, seconds]
+        else:
+            timer[0] += calls
+            timer[1] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        """ Time a block of code (e.g. `with metrics.timer("phase"):`) """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def as_dict(self, memory: bool = True) -> Dict:
+        """
+        :param memory: include the peak memory of the process (see peak_memory).
+        :return: dictionary with the counters, the timers (calls, total and mean seconds) and the memory.
+        """
+        result = {
+            "counters": dict(self.counters),
+            "timers": {name: {"calls": calls, "total": total, "mean": total / calls if calls else 0.0}
+                       for name, (calls, total) in self.timers.items()},
+        }
+        if memory:
+            result["memory"] = peak_memory()
+        return result
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def merge(self, other: Dict):
+        """ Add the counters and timers of an as_dict() output (e.g. from a worker process) """
+        for name, n in other.get("counters", {}).items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        for name, timer in other.get("timers", {}).items():
+            self.add_time(name, timer["total"], timer["calls"])
+
+
+# registry of the current process
+metrics = Metrics()
+
+
+def timed(name: str):
+    """ Decorator adding the calls of a function to the timer `name` of `metrics` when it is enabled """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def peak_memory() -> Dict:
+    """
+    Peak memory of the process in bytes: maximum resident set size (if the resource module is
+    available) and peak of the Python allocations traced by tracemalloc (if it is tracing).
+    """
+    result = {}
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["max_rss"] = max_rss if sys.platform == "darwin" else max_rss * 1024  # kilobytes on Linux
+    if tracemalloc.is_tracing():
+        result["traced_peak"] = tracemalloc.get_traced_memory()[1]
+    return result
+
+
+@contextlib.contextmanager
+def profiled(output: str = None, sort: str = "cumulative", limit: int = 25, stream=sys.stderr):
+    """
+    Run a block of code under cProfile and print its top `limit` functions by `sort`.
+
+    :param output: file where the raw profile is dumped (for pstats or snakeviz), not written if None.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if output:
+            profiler.dump_stats(output)
+            logger.info("Profile written to %s", output)
+        pstats.Stats(profiler, stream=stream).sort_stats(sort).print_stats(limit)
+
+
+@contextlib.contextmanager
+def traced_memory(limit: int = 10, frames: int = 1, stream=sys.stderr):
+    """
+    Run a block of code under tracemalloc and print its peak traced memory and the `limit` source
+    lines that hold the most memory at the end of the block.
+    """
+    tracemalloc.start(frames)
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Traced memory: current={current / 2**20:.1f} MiB, peak={peak / 2**20:.1f} MiB", file=stream)
+        for stat in snapshot.statistics("lineno")[:limit]:
+            print(stat, file=stream)
@@ -3,31 +3,93 @@ from gymnasium import spaces
 import numpy as np
 
 from emulation import Emulation, dynamic_param
-from heuristic import pj_heuristic, generate_new_route, find_max_reward_node
+from efficiencylist import EfficiencyList
+from geometry import Geometry
+from heuristic import pj_heuristic, generate_new_route, find_max_reward_node, ReplanCache
+from parallel import ReplanPool
+from localsearch import LocalSearch
+from metrics import metrics
+
+
+def array_observation_space(n_nodes: int, n_param: int = 4) -> spaces.Dict:
+    """
+    Fixed-shape observation space (arrays indexed by node id):
+        - visited: visited mask of the nodes
+        - node_features: x, y, reward, distance to the current node, distance to the end depot
+        - current_pos: id of the current node
+        - remaining_budget: max cost minus the accumulated (dynamic) cost
+        - conditions: dynamic parameters x_1..x_4
+    """
+    return spaces.Dict(
+        {
+            "visited": spaces.MultiBinary(n_nodes),
+            "node_features": spaces.Box(-np.inf, np.inf, shape=(n_nodes, 5), dtype=np.float32),
+            "current_pos": spaces.Discrete(n_nodes),
+            "remaining_budget": spaces.Box(-np.inf, np.inf, shape=(1,), dtype=np.float32),
+            "conditions": spaces.Box(0, 1, shape=(n_param,), dtype=np.float32),
+        }
+    )
 
 
 class OrienteeringEnv(gym.Env):
     metadata = {"render_modes": ["human", "rgb_array"]}
 
-    def __init__(self, nodes, max_cost, render_mode=None):
-
-        # Observations are dictionaries with the list of nodes, current position, path covered and conditions.
-        # There is the possibility of defining a Graph space (TODO)
-        self.observation_space = spaces.Dict(
-            {
-                # "nodes": spaces.Sequence(spaces.Box(0, 100, dtype=int)),
-                "nodes": spaces.Sequence(spaces.Discrete(len(nodes))),
-                # "current_pos": spaces.Box(0, 100, dtype=int),
-                "current_pos": spaces.Discrete(len(nodes)),
-                # "path_covered": spaces.Sequence(spaces.Box(0, 100, dtype=int)),
-                "path_covered": spaces.Sequence(spaces.Discrete(len(nodes))),
-                # "conditions": spaces.Tuple(spaces.Box(0, 1, dtype=float32)),
-                "x_1": spaces.Box(0, 1, dtype=float),
-                "x_2": spaces.Box(0, 1, dtype=float),
-                "x_3": spaces.Box(0, 1, dtype=float),
-                "x_4": spaces.Box(0, 1, dtype=float),
+    def __init__(self, nodes, max_cost, render_mode=None, obs_mode: str = "sequence", replan_cache: ReplanCache = None,
+                 geometry: Geometry = None, eff_list: EfficiencyList = None, local_search: LocalSearch = None,
+                 copy_obs: bool = True):
+        """
+        :param obs_mode: "sequence" (lists of node ids) or "array" (fixed-shape arrays, see
+            array_observation_space, kept in preallocated buffers that are updated in place at every step).
+        :param replan_cache: cache of the PJ replans (see ReplanCache), kept across episodes.
+        :param geometry: distances of the instance (e.g. attached from a SharedInstance), computed if not given.
+        :param eff_list: generated efficiency list of the instance used by the PJ replans, generated if not given.
+        :param local_search: post-optimization of the PJ replans (see LocalSearch).
+        :param copy_obs: in "array" mode, return a copy of the buffers at every reset/step. If False, the
+            buffers themselves are returned (no copy, but the observation is only valid until the next
+            step/reset and is not accepted by gymnasium's env checker).
+        """
+        assert obs_mode in ("sequence", "array")
+        self.obs_mode = obs_mode
+        self.copy_obs = copy_obs
+        self.replan_cache = replan_cache
+        self.local_search = local_search
+        self.emulation = Emulation(nodes, max_cost, geometry)
+        self.emulation.eff_list = eff_list
+        self.end_node = next(node for node in nodes if node.is_end)
+
+        if obs_mode == "array":
+            geometry = self.emulation.geometry
+            self.observation_space = array_observation_space(len(geometry))
+            self._obs = {
+                "visited": np.zeros(len(geometry), dtype=np.int8),
+                "node_features": np.zeros((len(geometry), 5), dtype=np.float32),
+                "current_pos": np.zeros((), dtype=np.int64),
+                "remaining_budget": np.zeros(1, dtype=np.float32),
+                "conditions": np.zeros(4, dtype=np.float32),
             }
-        )
+            # static node features are filled once
+            self._obs["node_features"][:, 0] = geometry.x
+            self._obs["node_features"][:, 1] = geometry.y
+            self._obs["node_features"][:, 2] = geometry.reward
+            self._obs["node_features"][:, 4] = geometry.matrix[:, self.end_node.id]
+        else:
+            # Observations are dictionaries with the list of nodes, current position, path covered and conditions.
+            # There is the possibility of defining a Graph space (TODO)
+            self.observation_space = spaces.Dict(
+                {
+                    # "nodes": spaces.Sequence(spaces.Box(0, 100, dtype=int)),
+                    "nodes": spaces.Sequence(spaces.Discrete(len(nodes))),
+                    # "current_pos": spaces.Box(0, 100, dtype=int),
+                    "current_pos": spaces.Discrete(len(nodes)),
+                    # "path_covered": spaces.Sequence(spaces.Box(0, 100, dtype=int)),
+                    "path_covered": spaces.Sequence(spaces.Discrete(len(nodes))),
+                    # "conditions": spaces.Tuple(spaces.Box(0, 1, dtype=float32)),
+                    "x_1": spaces.Box(0, 1, dtype=float),
+                    "x_2": spaces.Box(0, 1, dtype=float),
+                    "x_3": spaces.Box(0, 1, dtype=float),
+                    "x_4": spaces.Box(0, 1, dtype=float),
+                }
+            )
 
         # We have 2 actions: "pj_heuristic", "greedy"
         self.action_space = spaces.Discrete(2)
@@ -37,11 +99,24 @@ class OrienteeringEnv(gym.Env):
             1: "greedy",
         }
 
-        self.emulation = Emulation(nodes, max_cost)
-
         assert render_mode is None or render_mode in self.metadata["render_modes"]
         self.render_mode = render_mode
 
+    def _reset_array_obs(self):
+        self._obs["visited"][:] = 0
+        self._update_array_obs()
+
+    def _update_array_obs(self):
+        """ Incremental update of the array observation after a step (O(n)) """
+        emulation = self.emulation
+        obs = self._obs
+        obs["visited"][emulation.current_node.id] = 1
+        obs["node_features"][:, 3] = emulation.geometry.matrix[emulation.current_node.id]
+        obs["current_pos"][...] = emulation.current_node.id
+        obs["remaining_budget"][0] = emulation.max_cost - emulation.current_cost
+        obs["conditions"][:len(emulation.parameters)] = emulation.parameters
+        return obs
+
     def _get_obs(self):
         """
         Funtion to return a dictionary with the environment observations
@@ -50,8 +125,13 @@ class OrienteeringEnv(gym.Env):
         - path covered
         - dynamic conditions (x1, x2...)
         """
+        if self.obs_mode == "array":
+            if self.copy_obs:
+                return {key: value.copy() for key, value in self._obs.items()}
+            return self._obs
+        visited = set(self.emulation.path_covered)
         obs_dict = {
-            "nodes": [x.id for x in self.emulation.nodes if x not in self.emulation.path_covered],
+            "nodes": [x.id for x in self.emulation.nodes if x not in visited],
             "current_pos": self.emulation.current_node.id,
             "path_covered": [x.id for x in self.emulation.path_covered],
             "x_1": self.emulation.parameters[0],
@@ -62,15 +142,22 @@ class OrienteeringEnv(gym.Env):
         return obs_dict
 
     def _get_info(self):
-        return {
-            "step_number": len(self.emulation.path_covered)
+        info = {
+            "step_number": self.emulation.path_len
         }
+        if metrics.enabled:
+            # counters and timers of the process since metrics were enabled (or reset)
+            info["metrics"] = metrics.as_dict()
+        return info
 
     def reset(self, seed=None, options=None):
         # We need the following line to seed self.np_random
         super().reset(seed=seed)
 
         self.emulation.reset_emulator()
+        self.emulation.update_parameters(dynamic_param())
+        if self.obs_mode == "array":
+            self._reset_array_obs()
 
         observation = self._get_obs()
         info = self._get_info()
@@ -86,17 +173,19 @@ class OrienteeringEnv(gym.Env):
         if heuristic == "pj_heuristic":
             # run the pj heuristic and select the best option
             self.emulation.update_parameters(dynamic_param())
-            solution = generate_new_route(self.emulation)
-            next_node = solution.get_best_route().get_nodes()[1]
+            solution = generate_new_route(self.emulation, cache=self.replan_cache, local_search=self.local_search)
+            # go to the end depot if no feasible route is left
+            next_node_id = solution.get_best_route().get_nodes()[1] if solution else self.end_node.id
         elif heuristic == "greedy":
             # find the next node with the maximum (local) reward
-            next_node = find_max_reward_node(self.emulation)
-        self.emulation.step(next_node.id)
+            next_node_id = find_max_reward_node(self.emulation).id
+        self.emulation.step(next_node_id)
+        if self.obs_mode == "array":
+            self._update_array_obs()
 
         # An episode is done (terminated) if the vehicles arrives to the final node
         # No truncated situation (always valued as False)
-        # if 
-        terminated = np.array_equal(self._agent_location, self._target_location)
+        terminated = self.emulation.current_node is self.end_node
         
         #TODO: Reward every step based on the partial increase in score?
         #TODO: Reward at the end based on the total score achieved?
@@ -125,4 +214,165 @@ class OrienteeringEnv(gym.Env):
     def close(self):
         if self.window is not None:
             pygame.display.quit()
-            pygame.quit()
\ No newline at end of file
+            pygame.quit()
+
+
+class VectorOrienteeringEnv(gym.vector.VectorEnv):
+    """
+    Batch of num_envs orienteering episodes on the same instance, compatible with Gymnasium's vector API.
+    The state of all the episodes is held in NumPy arrays (current node, visited mask, path,
+    accumulated cost and reward, dynamic parameters): the greedy action and the cost updates
+    of the whole batch are computed in a single step, while the PJ replans of the episodes
+    that choose action 0 are sent to a pool of worker processes (ReplanPool).
+
+    Observations have a fixed shape so they can be batched (see array_observation_space).
+    Sub-environments that terminate are reset on the next step (AutoresetMode.NEXT_STEP).
+    """
+    metadata = {"render_modes": [], "autoreset_mode": gym.vector.AutoresetMode.NEXT_STEP}
+
+    def __init__(self, nodes, max_cost, num_envs: int, alpha: float = 0.5, workers: int = None, n_param: int = 4,
+                 shared: bool = False):
+        """
+        :param shared: publish the instance in shared memory for the replan workers (see SharedInstance).
+        """
+        self.nodes = nodes
+        self.max_cost = max_cost
+        self.num_envs = num_envs
+        self.alpha = alpha
+        self.n_param = n_param
+        self.geometry = Geometry(nodes)
+        n = len(self.geometry)
+        self.start_id = next(node.id for node in nodes if node.is_start)
+        self.end_id = next(node.id for node in nodes if node.is_end)
+        # customers (neither start nor end depots) that can be selected by the greedy action
+        self.customer_mask = np.zeros(n, dtype=bool)
+        self.customer_mask[[node.id for node in nodes if not node.is_start and not node.is_end]] = True
+
+        self.single_action_space = spaces.Discrete(2) # 0: "pj_heuristic", 1: "greedy"
+        self.action_space = gym.vector.utils.batch_space(self.single_action_space, num_envs)
+        self.single_observation_space = array_observation_space(n, n_param)
+        self.observation_space = gym.vector.utils.batch_space(self.single_observation_space, num_envs)
+
+        # batched episode state
+        self.current = np.full(num_envs, self.start_id, dtype=np.intp)
+        self.visited = np.zeros((num_envs, n), dtype=bool)
+        self.path = np.zeros((num_envs, n + 1), dtype=np.intp)
+        self.path_len = np.zeros(num_envs, dtype=np.intp)
+        self.current_cost = np.zeros(num_envs)
+        self.static_cost = np.zeros(num_envs)
+        self.current_reward = np.zeros(num_envs)
+        self.parameters = np.zeros((num_envs, n_param))
+        self._autoreset = np.zeros(num_envs, dtype=bool)
+
+        # preallocated observation buffers (static node features filled once)
+        self._obs = {
+            "visited": np.zeros((num_envs, n), dtype=np.int8),
+            "node_features": np.zeros((num_envs, n, 5), dtype=np.float32),
+            "current_pos": np.zeros(num_envs, dtype=np.int64),
+            "remaining_budget": np.zeros((num_envs, 1), dtype=np.float32),
+            "conditions": np.zeros((num_envs, n_param), dtype=np.float32),
+        }
+        self._obs["node_features"][:, :, 0] = self.geometry.x
+        self._obs["node_features"][:, :, 1] = self.geometry.y
+        self._obs["node_features"][:, :, 2] = self.geometry.reward
+        self._obs["node_features"][:, :, 4] = self.geometry.matrix[:, self.end_id]
+
+        eff_list = EfficiencyList(nodes, self.geometry).generate(alpha=alpha)
+        self.replan_pool = ReplanPool(nodes, max_cost, eff_list, workers, shared)
+
+    def _reset_envs(self, mask):
+        self.current[mask] = self.start_id
+        self.visited[mask] = False
+        self.visited[mask, self.start_id] = True
+        self.path[mask, 0] = self.start_id
+        self.path_len[mask] = 1
+        self.current_cost[mask] = 0.0
+        self.static_cost[mask] = 0.0
+        self.current_reward[mask] = 0.0
+        self.parameters[mask] = self.np_random.random((np.count_nonzero(mask), self.n_param))
+
+    def _get_obs(self):
+        obs = self._obs
+        obs["visited"][:] = self.visited
+        obs["node_features"][:, :, 3] = self.geometry.matrix[self.current]
+        obs["current_pos"][:] = self.current
+        obs["remaining_budget"][:, 0] = self.max_cost - self.current_cost
+        obs["conditions"][:] = self.parameters
+        return {key: value.copy() for key, value in obs.items()}
+
+    def _get_info(self):
+        return {
+            "step_number": self.path_len.copy(),
+            "current_reward": self.current_reward.copy(),
+            "current_cost": self.current_cost.copy(),
+        }
+
+    def greedy_nodes(self, envs):
+        """
+        Next node of the greedy action for the given episodes: the unvisited customer with the
+        maximum reward (ties broken by the distance to the current node) from which the end depot
+        can still be reached within the remaining budget, or the end depot if there is none.
+        """
+        dist = self.geometry.matrix
+        remaining_budget = self.max_cost - self.current_cost[envs]
+        infeasible = dist[self.current[envs]] + dist[:, self.end_id] > remaining_budget[:, np.newaxis]
+        rewards = np.where(self.visited[envs] | ~self.customer_mask | infeasible, -np.inf, self.geometry.reward)
+        max_reward = rewards.max(axis=1)
+        distances = np.where(rewards == max_reward[:, np.newaxis], self.geometry.matrix[self.current[envs]], np.inf)
+        next_nodes = distances.argmin(axis=1)
+        next_nodes[~(max_reward > 0)] = self.end_id
+        return next_nodes
+
+    def pj_nodes(self, envs):
+        """ Next node of the PJ action (replan with generate_new_route) for the given episodes """
+        tasks = [(self.path[env, :self.path_len[env]].tolist(), float(self.static_cost[env]), self.alpha) for env in envs]
+        return np.array(self.replan_pool.next_nodes(tasks), dtype=np.intp)
+
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed)
+        self._autoreset[:] = False
+        self._reset_envs(np.ones(self.num_envs, dtype=bool))
+        return self._get_obs(), self._get_info()
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        rewards = np.zeros(self.num_envs)
+        terminated = np.zeros(self.num_envs, dtype=bool)
+        truncated = np.zeros(self.num_envs, dtype=bool)
+
+        # episodes that finished in the previous step are reset instead of stepped
+        reset_mask = self._autoreset.copy()
+        if reset_mask.any():
+            self._reset_envs(reset_mask)
+        active = ~reset_mask
+
+        next_nodes = self.current.copy()
+        greedy_envs = np.flatnonzero(active & (actions == 1))
+        pj_envs = np.flatnonzero(active & (actions == 0))
+        if len(greedy_envs):
+            next_nodes[greedy_envs] = self.greedy_nodes(greedy_envs)
+        if len(pj_envs):
+            next_nodes[pj_envs] = self.pj_nodes(pj_envs)
+
+        # move the active episodes: static distance plus the dynamic component of the step
+        envs = np.flatnonzero(active)
+        distance_static = self.geometry.matrix[self.current[envs], next_nodes[envs]]
+        tstep = self.path_len[envs][:, np.newaxis]
+        distance_dynamic = distance_static + np.sin(tstep * np.pi * self.parameters[envs]).sum(axis=1)
+        self.current_cost[envs] += distance_dynamic
+        self.static_cost[envs] += distance_static
+        self.current_reward[envs] += self.geometry.reward[next_nodes[envs]]
+        self.current[envs] = next_nodes[envs]
+        self.visited[envs, next_nodes[envs]] = True
+        self.path[envs, self.path_len[envs]] = next_nodes[envs]
+        self.path_len[envs] += 1
+        self.parameters[envs] = self.np_random.random((len(envs), self.n_param))
+
+        # An episode is done (terminated) if the vehicles arrives to the final node
+        terminated[envs] = self.current[envs] == self.end_id
+        rewards[terminated] = 1.0  # Binary sparse rewards
+        self._autoreset = terminated | truncated
+        return self._get_obs(), rewards, terminated, truncated, self._get_info()
+
+    def close_extras(self, **kwargs):
+        self.replan_pool.close()
@@ -0,0 +1,279 @@
+import os
+import time
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from importer import Importer
+from efficiencylist import EfficiencyList
+from emulation import Emulation
+from heuristic import pj_heuristic, generate_new_route
+from sharedmem import SharedInstance, SharedInstanceHandle, attach_instance
+
+# instance data of a worker process, shipped once by the pool initializer
+_worker_data = {}
+
+
+def _init_pool_worker(initializer, instance, initargs):
+    """ Initializer of the workers of a WorkerPool: attach to the instance if it is published in shared memory """
+    if isinstance(instance, SharedInstanceHandle):
+        attached = attach_instance(instance)
+        _worker_data["shared"] = attached  # keeps the block mapped for the lifetime of the worker
+        instance = (attached.nodes, attached.max_cost, attached.eff_list, attached.geometry)
+    initializer(*instance, *initargs)
+
+
+class WorkerPool:
+    """
+    Process pool whose workers receive the data of one instance once: each worker runs
+    initializer(nodes, max_cost, eff_list, geometry, *initargs), which keeps what the tasks need
+    (in a module-level dict of the initializer's module, e.g. _worker_data).
+    The instance is shipped to each worker, or published in a SharedInstance (owned by the pool
+    and unlinked on close) if shared is True.
+    With a single worker there is no process pool: the initializer runs in the current process
+    and map runs the tasks in it (executor is None).
+    """
+    def __init__(self, initializer, nodes, max_cost, eff_list=None, geometry=None, initargs=(),
+                 workers: int = None, shared: bool = False) -> None:
+        """
+        :param initializer: module-level function storing the instance data of a worker.
+        :param eff_list: generated efficiency list of the instance, if the tasks need it.
+        :param geometry: distances of the instance (those of eff_list if not given).
+        :param initargs: additional arguments of the initializer.
+        :param workers: number of worker processes (all cores by default).
+        :param shared: publish the instance in shared memory instead of shipping it to each worker.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        if geometry is None and eff_list is not None:
+            geometry = eff_list.geometry
+        self.executor = None
+        self.shared_instance = None
+        if self.workers == 1:
+            initializer(nodes, max_cost, eff_list, geometry, *initargs)
+            return
+        instance = (nodes, max_cost, eff_list, geometry)
+        if shared:
+            self.shared_instance = SharedInstance(nodes, max_cost, eff_list, geometry)
+            instance = self.shared_instance.handle
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_pool_worker,
+                                            initargs=(initializer, instance, initargs))
+
+    def submit(self, function, *args):
+        return self.executor.submit(function, *args)
+
+    def map(self, function, iterable, chunksize: int = 1):
+        """ Results of function over iterable, in order """
+        if self.executor is None:
+            return map(function, iterable)
+        return self.executor.map(function, iterable, chunksize=chunksize)
+
+    def close(self, cancel_futures: bool = False):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=cancel_futures)
+            self.executor = None
+        if self.shared_instance is not None:
+            self.shared_instance.close()
+            self.shared_instance = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _init_worker(nodes, max_cost, eff_list, geometry):
+    _worker_data["nodes"] = nodes
+    _worker_data["eff_list"] = eff_list
+    _worker_data["route_max_cost"] = max_cost
+
+
+def _run_br_pj(seed):
+    """ Run one biased-randomized PJ construction with its own random stream """
+    rng = random.Random(seed)
+    sol = pj_heuristic(_worker_data["nodes"], _worker_data["eff_list"], _worker_data["route_max_cost"], useBR=True, rng=rng)
+    if sol is None:
+        return None
+    return sol.get_best_route()
+
+
+def _evaluate_alpha(task):
+    """ Greedy PJ run, plus BR runs (one per seed), for a given alpha: return the best solution """
+    alpha, seeds = task
+    eff_list = _worker_data["eff_list"].with_alpha(alpha)
+    best_sol, best_route = None, None
+    for seed in [None] + seeds:
+        if seed is None:
+            # obtain a greedy solution (BR = False) for the current alpha value
+            sol = pj_heuristic(_worker_data["nodes"], eff_list, _worker_data["route_max_cost"], useBR=False)
+        else:
+            sol = pj_heuristic(_worker_data["nodes"], eff_list, _worker_data["route_max_cost"], useBR=True, rng=random.Random(seed))
+        if sol is None:
+            continue
+        route = sol.get_best_route()
+        if best_route is None or (route.reward, -route.cost) > (best_route.reward, -best_route.cost):
+            best_sol, best_route = sol, route
+    return best_sol
+
+
+def _init_replan_worker(nodes, max_cost, eff_list, geometry):
+    _worker_data["emulation"] = Emulation(nodes, max_cost, geometry)
+    _worker_data["replan_eff_list"] = eff_list
+    _worker_data["node_by_id"] = {node.id: node for node in nodes}
+
+
+def _replan_next_node(task):
+    """
+    PJ replan (generate_new_route) from an emulation state given as (path of node ids, static cost, alpha).
+    Returns the id of the next node of the best route, or the end depot if there is no feasible route.
+    """
+    path, static_cost, alpha = task
+    emulation = _worker_data["emulation"]
+    node_by_id = _worker_data["node_by_id"]
+    emulation.path_covered = [node_by_id[node_id] for node_id in path]
+    emulation.static_cost = static_cost
+    solution = generate_new_route(emulation, _worker_data["replan_eff_list"], alpha)
+    if solution is None:
+        return emulation.nodes[-1].id
+    return solution.get_best_route().get_nodes()[1]
+
+
+class ReplanPool:
+    """
+    Persistent pool of processes answering PJ replans (see _replan_next_node) for one instance
+    (see WorkerPool for how the instance reaches the workers).
+    """
+    def __init__(self, nodes, max_cost, eff_list, workers: int = None, shared: bool = False) -> None:
+        self.pool = WorkerPool(_init_replan_worker, nodes, max_cost, eff_list, workers=workers, shared=shared)
+
+    def next_nodes(self, tasks):
+        """ Next node id for each task (path of node ids, static cost, alpha), in order """
+        return list(self.pool.map(_replan_next_node, tasks))
+
+    def close(self):
+        self.pool.close()
+
+
+def spawn_seeds(master_seed, n_runs: int):
+    """
+    Derive one independent seed per run from a master seed (numpy SeedSequence),
+    so that run k always uses the same random stream for the same master seed
+    """
+    seed_seq = np.random.SeedSequence(master_seed)
+    seeds = [int(child.generate_state(1, dtype=np.uint64)[0]) for child in seed_seq.spawn(n_runs)]
+    return seeds, seed_seq.entropy
+
+
+def run_pool(function, args, initargs, workers: int = None, shared: bool = False):
+    """
+    Map function over args in a WorkerPool whose workers receive initargs
+    (nodes, eff_list, route_max_cost) once, or attach to them in shared memory if shared is True.
+    With a single worker (or task) everything runs in the current process.
+    Results are returned in the order of args.
+    """
+    workers = workers or os.cpu_count() or 1
+    if len(args) <= 1:
+        workers = 1
+    nodes, eff_list, route_max_cost = initargs
+    with WorkerPool(_init_worker, nodes, route_max_cost, eff_list, workers=workers, shared=shared) as pool:
+        return list(pool.map(function, args, chunksize=max(1, len(args) // (4 * workers))))
+
+
+def multi_start_pj(nodes, eff_list, route_max_cost, n_runs: int, seed: int = None, workers: int = None,
+                   shared: bool = False):
+    """
+    Run n_runs biased-randomized PJ constructions across a process pool.
+    Run k uses its own random.Random stream derived from the master seed, so results
+    are reproducible for a given seed regardless of the number of workers.
+
+    :param nodes: list of nodes of the instance.
+    :param eff_list: generated efficiency list of the instance.
+    :param route_max_cost: maximum cost of the route.
+    :param n_runs: number of BR-PJ runs.
+    :param seed: master seed (fresh entropy if None, reported in the statistics).
+    :param workers: number of worker processes (all cores by default).
+    :param shared: publish the instance in shared memory instead of shipping it to each worker.
+    :return: tuple (best route, statistics dictionary).
+    """
+    start_time = time.perf_counter()
+    seeds, entropy = spawn_seeds(seed, n_runs)
+    routes = run_pool(_run_br_pj, seeds, (nodes, eff_list, route_max_cost), workers, shared)
+
+    # best route by reward, then cost, then run number
+    runs = [(k, route) for k, route in enumerate(routes) if route is not None]
+    best_run, best_route = None, None
+    if runs:
+        runs.sort(key = lambda run: run[1].cost)
+        runs.sort(key = lambda run: run[1].reward, reverse = True)
+        best_run, best_route = runs[0]
+    rewards = np.array([route.reward for _, route in runs])
+    stats = {
+        "seed": entropy,
+        "n_runs": n_runs,
+        "feasible_runs": len(runs),
+        "best_run": best_run,
+        "best_seed": seeds[best_run] if best_run is not None else None,
+        "best_reward": best_route.reward if best_route else None,
+        "best_cost": best_route.cost if best_route else None,
+        "mean_reward": float(rewards.mean()) if len(rewards) else None,
+        "std_reward": float(rewards.std()) if len(rewards) else None,
+        "min_reward": float(rewards.min()) if len(rewards) else None,
+        "elapsed_time": time.perf_counter() - start_time,
+    }
+    return best_route, stats
+
+
+def tune_alpha(eff_list, route_max_cost, alphas=None, n_br_runs: int = 0, refinements: int = 0,
+               seed: int = None, workers: int = None, shared: bool = False):
+    """
+    Tune the alpha value of the efficiency list. Each alpha of the grid is evaluated in a
+    worker with a greedy PJ run and n_br_runs BR-PJ runs; all of them reuse the savings and
+    edge rewards of eff_list (shipped once per worker), since the efficiency is linear in alpha.
+    Each refinement evaluates a finer grid (same number of points) around the best alpha so far.
+
+    :param eff_list: generated efficiency list of the instance.
+    :param route_max_cost: maximum cost of the route.
+    :param alphas: grid of alpha values (0, 0.1, ..., 1 by default).
+    :param n_br_runs: number of BR-PJ runs per alpha (in addition to the greedy one).
+    :param refinements: number of adaptive refinements of the grid.
+    :param seed: master seed of the BR runs.
+    :param workers: number of worker processes (all cores by default).
+    :param shared: publish the instance in shared memory instead of shipping it to each worker.
+    :return: tuple (best alpha, best initial solution).
+    """
+    alphas = list(np.linspace(0, 1, 11) if alphas is None else alphas)
+    n_levels = refinements + 1
+    seeds, _ = spawn_seeds(seed, n_levels * len(alphas) * n_br_runs)
+    initargs = (eff_list.nodes, eff_list, route_max_cost)
+    best_alpha, best_sol, best_key = None, None, None
+    for level in range(n_levels):
+        level_seeds = seeds[level * len(alphas) * n_br_runs:(level + 1) * len(alphas) * n_br_runs]
+        tasks = [(float(alpha), level_seeds[k * n_br_runs:(k + 1) * n_br_runs]) for k, alpha in enumerate(alphas)]
+        solutions = run_pool(_evaluate_alpha, tasks, initargs, workers, shared)
+        for (alpha, _), sol in zip(tasks, solutions):
+            if sol is None:
+                continue
+            route = sol.get_best_route()
+            if best_key is None or (route.reward, -route.cost) > best_key:
+                best_alpha, best_sol, best_key = alpha, sol, (route.reward, -route.cost)
+        if best_alpha is None:
+            break
+        # finer grid around the best alpha
+        step = (max(alphas) - min(alphas)) / max(len(alphas) - 1, 1)
+        alphas = np.linspace(max(0.0, best_alpha - step), min(1.0, best_alpha + step), len(alphas))
+    return best_alpha, best_sol
+
+
+if __name__ == "__main__":
+    file_path = "input/ref/Tsiligirides 3/tsiligirides_problem_3_budget_070.txt"
+    importer = Importer(file_path)
+    nodes = importer.node_data
+    routeMaxCost = importer.Tmax
+
+    eff_list = EfficiencyList(nodes)
+    eff_list.generate(alpha=0.5)
+
+    best_route, stats = multi_start_pj(nodes, eff_list, routeMaxCost, n_runs=100, seed=1)
+    print(best_route, best_route.reward, best_route.cost)
+    print(stats)
@@ -0,0 +1,185 @@
+import os
+import time
+import random
+from typing import Dict, List
+from concurrent.futures import wait, FIRST_COMPLETED
+
+import numpy as np
+
+from node import Node
+from geometry import Geometry
+from emulation import Emulation
+from parallel import WorkerPool
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+_worker_data = {}
+
+
+def _init_rollout_worker(nodes, max_cost, eff_list, geometry):
+    _worker_data["emulation"] = Emulation(nodes, max_cost, geometry)
+
+
+def run_rollouts(emulation: Emulation, candidate_id: int, n_rollouts: int, seed: int, key: str = "reward",
+                 margin: float = 0.0, n_param: int = 4, deadline: float = None):
+    """
+    Simulate n_rollouts continuations of the emulation that move to the candidate node and then
+    follow the (feasibility-aware) greedy policy until the end depot. The dynamic parameters
+    of every step are sampled (uniform in [0, 1), as dynamic_param) from a random.Random(seed).
+    The greedy policy keeps a safety margin (cost units) of the budget for the dynamic costs.
+    With a deadline (time.time() value, valid across processes), no rollout is started after it.
+
+    :return: tuple (final rewards, final costs) arrays of the rollouts done.
+    """
+    rng = random.Random(seed)
+    end_node = emulation.greedy_selector.end_node
+    rewards = np.empty(n_rollouts)
+    costs = np.empty(n_rollouts)
+    for r in range(n_rollouts):
+        if deadline is not None and time.time() > deadline:
+            return rewards[:r], costs[:r]
+        branch = emulation.fork()
+        branch.update_parameters([rng.random() for _ in range(n_param)])
+        branch.step(candidate_id)
+        while branch.current_node is not end_node:
+            branch.update_parameters([rng.random() for _ in range(n_param)])
+            next_node = branch.greedy_selector.select(branch.current_node, branch.max_cost - margin - branch.current_cost, key)
+            branch.step(next_node.id)
+        rewards[r] = branch.current_reward
+        costs[r] = branch.current_cost
+    return rewards, costs
+
+
+def _rollout_chunk(task):
+    snapshot, candidate_id, n_rollouts, seed, key, margin, deadline = task
+    emulation = _worker_data["emulation"]
+    emulation.restore(snapshot)
+    rewards, costs = run_rollouts(emulation, candidate_id, n_rollouts, seed, key, margin, deadline=deadline)
+    return candidate_id, rewards, costs
+
+
+class RolloutPolicy:
+    """
+    Monte Carlo lookahead (simheuristic) policy: the top-k candidate next nodes are evaluated by
+    simulating continuations of the current Emulation (forks) under sampled dynamic parameters,
+    followed by the greedy policy. The selected node is the one with the best expected reward
+    among those whose probability of breaking the budget (final cost > max cost) is below a limit;
+    the end depot is selected if there is none.
+    Rollouts are run in chunks across a process pool, within a time budget per decision.
+    """
+    def __init__(self, nodes: List[Node], max_cost: float, geometry: Geometry = None, top_k: int = 5,
+                 n_rollouts: int = 100, max_break_prob: float = 0.05, time_budget: float = 1.0,
+                 chunk_size: int = 25, key: str = "reward", base_margin: float = 0.05,
+                 workers: int = None, seed: int = None, shared: bool = False) -> None:
+        """
+        :param nodes: list of nodes of the instance.
+        :param max_cost: maximum cost (budget) of the route.
+        :param geometry: precomputed distances of the instance (computed if not provided).
+        :param top_k: number of candidate next nodes (best greedy candidates).
+        :param n_rollouts: number of rollouts per candidate.
+        :param max_break_prob: maximum probability of exceeding the budget of a selected node.
+        :param time_budget: wall-clock seconds per decision (rollouts not finished by then are ignored).
+        :param chunk_size: number of rollouts per task sent to the pool.
+        :param key: greedy key of the candidates and of the base policy ("reward" or "efficiency").
+        :param base_margin: fraction of the max cost kept by the base policy for the dynamic costs.
+        :param workers: number of worker processes (all cores by default; 1 runs in-process).
+        :param seed: master seed of the sampled parameters.
+        :param shared: publish the instance in shared memory for the workers (see SharedInstance).
+        """
+        self.max_cost = max_cost
+        self.geometry = geometry if geometry is not None else Geometry(nodes)
+        self.top_k = top_k
+        self.n_rollouts = n_rollouts
+        self.max_break_prob = max_break_prob
+        self.time_budget = time_budget
+        self.chunk_size = chunk_size
+        self.key = key
+        self.margin = base_margin * max_cost
+        self.seed_seq = np.random.SeedSequence(seed)
+        self.last_decision: Dict = {}
+        self.workers = workers or os.cpu_count() or 1
+        # in-process rollouts run on forks of the given emulation
+        self.pool = None
+        if self.workers > 1:
+            self.pool = WorkerPool(_init_rollout_worker, nodes, max_cost, geometry=self.geometry,
+                                   workers=self.workers, shared=shared)
+
+    def _evaluate(self, emulation: Emulation, candidates: List[Node], deadline: float):
+        """
+        Run the rollouts of the candidates until they are done or the deadline (time.time() value)
+        is reached: chunks not started by then are cancelled and the running ones stop early.
+        """
+        snapshot = emulation.snapshot()
+        # chunks interleave the candidates, so that all of them get rollouts if time runs out
+        tasks = []
+        for start in range(0, self.n_rollouts, self.chunk_size):
+            size = min(self.chunk_size, self.n_rollouts - start)
+            for candidate, child in zip(candidates, self.seed_seq.spawn(len(candidates))):
+                tasks.append((snapshot, candidate.id, size, int(child.generate_state(1)[0]), self.key, self.margin, deadline))
+
+        results = {candidate.id: ([], []) for candidate in candidates}
+        if self.pool is None:
+            for task in tasks:
+                if time.time() > deadline:
+                    break
+                rewards, costs = run_rollouts(emulation.fork(), *task[1:6], deadline=deadline)
+                results[task[1]][0].append(rewards)
+                results[task[1]][1].append(costs)
+        else:
+            pending = {self.pool.submit(_rollout_chunk, task) for task in tasks}
+            cancelled = False
+            while pending:
+                timeout = None if cancelled else max(0.0, deadline - time.time())
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.cancelled():
+                        continue
+                    candidate_id, rewards, costs = future.result()
+                    results[candidate_id][0].append(rewards)
+                    results[candidate_id][1].append(costs)
+                if not cancelled and time.time() > deadline:
+                    # the chunks already running stop at the deadline too (after their current
+                    # rollout): they are waited for, so that they do not hold the workers
+                    for future in pending:
+                        future.cancel()
+                    cancelled = True
+        return results
+
+    def select(self, emulation: Emulation) -> Node:
+        """
+        Select the next node for the current state of the emulation.
+        Statistics of the decision are kept in last_decision.
+        """
+        deadline = time.time() + self.time_budget
+        end_node = emulation.greedy_selector.end_node
+        remaining_budget = emulation.max_cost - emulation.current_cost
+        candidates = emulation.greedy_selector.top_k(emulation.current_node, remaining_budget, self.top_k, self.key)
+        self.last_decision = {"candidates": {}, "selected": end_node.id}
+        if not candidates:
+            return end_node
+
+        best_node, best_reward = end_node, -np.inf
+        for candidate_id, (rewards, costs) in self._evaluate(emulation, candidates, deadline).items():
+            if not rewards:
+                continue
+            rewards, costs = np.concatenate(rewards), np.concatenate(costs)
+            if not len(rewards):
+                continue
+            expected_reward = float(rewards.mean())
+            break_prob = float(np.mean(costs > self.max_cost))
+            self.last_decision["candidates"][candidate_id] = {
+                "expected_reward": expected_reward,
+                "break_prob": break_prob,
+                "rollouts": len(rewards),
+            }
+            if break_prob <= self.max_break_prob and expected_reward > best_reward:
+                best_node, best_reward = emulation.get_node(candidate_id), expected_reward
+        self.last_decision["selected"] = best_node.id
+        logger.debug("Rollout decision: %s", self.last_decision)
+        return best_node
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close(cancel_futures=True)
+            self.pool = None
@@ -17,17 +17,40 @@ class Route:
         self.arcs: List[Arc] = []  # sorted arcs in this route
         self.cost: float = 0.0  # cost of this route
         self.reward: float = 0.0  # total reward collected in this route
+        self._nodes: List[int] = None  # cached node ids of the route (see get_nodes)
+        self._name: str = None  # cached route name (see compile_route_name)
 
     def add_arc(self, new_arc):
         self.arcs.append(new_arc)
-        self.compute_cost()
-        self.compute_reward()
+        self.cost += new_arc.cost
+        self.reward += new_arc.end.reward
+        self._invalidate()
 
     def remove_arc(self, new_arc):
         self.arcs.remove(new_arc)
-        self.compute_cost()
-        self.compute_reward()
-    
+        self.cost -= new_arc.cost
+        self.reward -= new_arc.end.reward
+        self._invalidate()
+
+    def merge(self, route, arc):
+        """
+        Splice route onto the end of this route through arc (i, j), where i is the last
+        customer of this route and j the first customer of route: the arcs (i, end) and
+        (start, j) are replaced by (i, j). Cost and reward are updated incrementally.
+        """
+        arc_i = self.arcs[-1] # arc_i is (i, finish)
+        arc_j = route.arcs[0] # arc_j is (start, j)
+        self.arcs[-1:] = [arc]
+        self.arcs.extend(route.arcs[1:])
+        self.cost += arc.cost - arc_i.cost + route.cost - arc_j.cost
+        self.reward += arc.end.reward - arc_i.end.reward + route.reward - arc_j.end.reward
+        self._invalidate()
+        return self
+
+    def _invalidate(self):
+        self._nodes = None
+        self._name = None
+
     def compute_cost(self):
         self.cost = 0.0 # reset
         for arc in self.arcs:
@@ -43,11 +66,9 @@ class Route:
         return self.reward
 
     def compile_route_name(self):
-        route_name = f"Route {self.arcs[0].start.id}-"
-        for arc in self.arcs[:-1]:
-            route_name += f"{arc.end.id}-"
-        route_name += f"{self.arcs[-1].end.id}"
-        return route_name
+        if self._name is None:
+            self._name = "Route " + "-".join(str(node_id) for node_id in self.get_nodes())
+        return self._name
 
     def __str__(self) -> str:
         return self.compile_route_name()
@@ -55,24 +76,31 @@ class Route:
     def __repr__(self) -> str:
         return self.compile_route_name()
 
+    @property
+    def first_node(self):
+        """ First customer of the route (the one linked to the start depot) """
+        return self.arcs[0].end if self.arcs else None
+
+    @property
+    def last_node(self):
+        """ Last customer of the route (the one linked to the end depot) """
+        return self.arcs[-1].start if self.arcs else None
+
+    def get_customers(self):
+        """ Nodes visited by the route, excluding the start and end depots """
+        return [arc.end for arc in self.arcs[:-1]]
+
     def is_linked_to_start(self, node):
-        for arc in self.arcs:
-            if arc.end == node and arc.start.is_start:
-                return True
-        return False
+        return self.first_node == node and self.arcs[0].start.is_start
 
     def is_linked_to_end(self, node):
-        for arc in self.arcs:
-            if arc.start == node and arc.end.is_end:
-                return True
-        return False
+        return self.last_node == node and self.arcs[-1].end.is_end
 
     def get_nodes(self):
-        node_list = []
-        node_list.append(self.arcs[0].start.id)
-        for arc in self.arcs:
-            node_list.append(arc.end.id)
-        return node_list
+        """ Node ids of the route (cached until the route is modified) """
+        if self._nodes is None:
+            self._nodes = [self.arcs[0].start.id] + [arc.end.id for arc in self.arcs]
+        return self._nodes
 
     #TODO: implement check for route: is the sequence of nodes/arcs correct?
 
@@ -0,0 +1,148 @@
+from multiprocessing import shared_memory
+from typing import Dict, List
+
+import numpy as np
+
+from node import Node
+from geometry import Geometry
+from efficiencylist import EfficiencyList
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# offsets of the arrays in the shared block are aligned to this number of bytes
+ALIGNMENT = 64
+
+
+class SharedInstanceHandle:
+    """
+    Picklable reference to a SharedInstance: name of the shared memory block and layout of its
+    arrays. Workers receive the handle (a few hundred bytes) and attach to the block.
+    """
+    def __init__(self, name: str, layout: Dict, max_cost: float, alpha: float = None, n_customers: int = 0) -> None:
+        self.name = name
+        self.layout = layout  # array name -> (offset, dtype, shape)
+        self.max_cost = max_cost
+        self.alpha = alpha
+        self.n_customers = n_customers
+
+    def __repr__(self) -> str:
+        return f"SharedInstanceHandle({self.name}, {len(self.layout)} arrays)"
+
+
+class SharedInstance:
+    """
+    Instance data published once into a multiprocessing.shared_memory block: node ids, coordinates,
+    rewards and start/end flags, the distance matrix and, optionally, the arc arrays, sorted
+    order and ranks of a generated efficiency list. The creator owns the block and unlinks it on close.
+    """
+    def __init__(self, nodes: List[Node], max_cost: float, eff_list: EfficiencyList = None,
+                 geometry: Geometry = None) -> None:
+        """
+        :param nodes: list of nodes of the instance.
+        :param max_cost: maximum cost of the route.
+        :param eff_list: generated efficiency list to publish (its geometry is used if given).
+        :param geometry: distances of the instance (computed if not provided).
+        """
+        if geometry is None:
+            geometry = eff_list.geometry if eff_list is not None else Geometry(nodes)
+        arrays = {
+            "ids": np.array([node.id for node in nodes], dtype=np.intp),
+            "is_start": np.array([node.is_start for node in nodes], dtype=bool),
+            "is_end": np.array([node.is_end for node in nodes], dtype=bool),
+            "x": geometry.x,
+            "y": geometry.y,
+            "reward": geometry.reward,
+            "matrix": geometry.matrix,
+        }
+        alpha, n_customers = None, 0
+        if eff_list is not None:
+            order = eff_list.sorted_arcs()
+            rank = np.full(len(eff_list.start), -1, dtype=np.intp)
+            rank[order] = np.arange(len(order))
+            arrays.update({
+                "eff_ids": np.array([node.id for node in eff_list.nodes], dtype=np.intp),
+                "start": eff_list.start,
+                "end": eff_list.end,
+                "cost": eff_list.cost,
+                "savings": eff_list.savings,
+                "edge_reward": eff_list.edge_reward,
+                "efficiency": eff_list.efficiency,
+                "position": eff_list._position,
+                "order": order,
+                "rank": rank,
+            })
+            if eff_list._pair_keys is not None:
+                arrays.update({
+                    "pair_keys": eff_list._pair_keys,
+                    "incident_ptr": eff_list._incident_ptr,
+                    "incident": eff_list._incident,
+                })
+            alpha, n_customers = eff_list.alpha, eff_list._n_customers
+
+        layout, offset = {}, 0
+        for name, array in arrays.items():
+            layout[name] = (offset, array.dtype.str, array.shape)
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for name, array in arrays.items():
+            _view(self.shm, layout[name])[...] = array
+        self.handle = SharedInstanceHandle(self.shm.name, layout, max_cost, alpha, n_customers)
+        logger.debug("Published %s (%d bytes)", self.handle, offset)
+
+    @property
+    def nbytes(self) -> int:
+        return self.shm.size
+
+    def close(self):
+        """ Release and unlink the block (attached workers keep their mapping until they close it) """
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AttachedInstance:
+    """
+    Instance rebuilt from a SharedInstanceHandle: the arrays are views of the shared block
+    (read-only). Only the Node objects and, for the efficiency list, the alive flags (one byte
+    per arc) and the Fenwick tree (a list of one int per arc, built with NumPy) are allocated.
+    """
+    def __init__(self, handle: SharedInstanceHandle) -> None:
+        self.shm = shared_memory.SharedMemory(name=handle.name)
+        self.max_cost = handle.max_cost
+        arrays = {name: _view(self.shm, spec) for name, spec in handle.layout.items()}
+        for array in arrays.values():
+            array.flags.writeable = False
+        self.arrays = arrays
+        self.nodes = [Node(node_id, x, y, reward, is_start, is_end) for node_id, x, y, reward, is_start, is_end in zip(
+            arrays["ids"].tolist(), arrays["x"][arrays["ids"]].tolist(), arrays["y"][arrays["ids"]].tolist(),
+            arrays["reward"][arrays["ids"]].tolist(), arrays["is_start"].tolist(), arrays["is_end"].tolist())]
+        self.geometry = Geometry.from_arrays(arrays["x"], arrays["y"], arrays["reward"], arrays["matrix"])
+        self.eff_list = None
+        if "order" in arrays:
+            node_by_id = {node.id: node for node in self.nodes}
+            eff_nodes = [node_by_id[node_id] for node_id in arrays["eff_ids"].tolist()]
+            self.eff_list = EfficiencyList.from_arrays(eff_nodes, self.geometry, arrays, handle.alpha, handle.n_customers)
+
+    def close(self):
+        """ Detach from the block, once the objects built on it (nodes, geometry, eff_list) are released """
+        self.arrays = None
+        self.geometry = None
+        self.eff_list = None
+        self.shm.close()
+
+
+def _view(shm: shared_memory.SharedMemory, spec) -> np.ndarray:
+    offset, dtype, shape = spec
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+
+
+def attach_instance(handle: SharedInstanceHandle) -> AttachedInstance:
+    return AttachedInstance(handle)
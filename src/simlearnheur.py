@@ -1,7 +1,70 @@
+import os
+import time
+import json
+import heapq
+import random
+import logging
+import argparse
+import contextlib
+from concurrent.futures import wait, FIRST_COMPLETED
+
+import numpy as np
+
+from logs import get_logger, set_log_level
 from importer import Importer
 from efficiencylist import EfficiencyList
-from emulation import Emulation, dynamic_param
-from heuristic import pj_heuristic, generate_new_route
+from emulation import Emulation, dynamic_param, dynamic_scenarios
+from heuristic import pj_heuristic, generate_new_route, ReplanCache
+from rollout import RolloutPolicy
+from parallel import WorkerPool
+from localsearch import LocalSearch
+from metrics import metrics, profiled, traced_memory
+
+logger = get_logger(__name__)
+
+_worker_data = {}
+
+
+def _init_episode_worker(nodes, max_cost, eff_list, geometry, options, collect_metrics: bool = False):
+    _worker_data["nodes"] = nodes
+    _worker_data["max_cost"] = max_cost
+    # shipped once, so that the objects of the options (e.g. a ReplanCache) are shared by the episodes of a worker
+    _worker_data["options"] = options
+    # metrics of a worker process are sent back with each episode
+    _worker_data["metrics"] = collect_metrics
+    metrics.enable(collect_metrics or metrics.enabled)
+
+
+def _run_episode(task):
+    """
+    Run one emulation episode (SimLearnHeuristic.run_heuristic) with its own seed and return
+    a summary of its result with the measured wall-clock and CPU times of the episode
+    (and the metrics of the episode in a worker process that collects them).
+    """
+    type, seed = task
+    nodes, max_cost, options = _worker_data["nodes"], _worker_data["max_cost"], _worker_data["options"]
+    if _worker_data.get("metrics"):
+        metrics.reset()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    emulator = SimLearnHeuristic(0, 0, 0).run_heuristic(type, nodes, max_cost, seed=seed, **options)
+    result = {
+        "seed": seed,
+        "path": [node.id for node in emulator.path_covered],
+        "reward": emulator.current_reward,
+        "cost": emulator.current_cost,
+        "static_cost": emulator.static_cost,
+        "feasible": emulator.current_cost <= max_cost,
+        "wall_time": time.perf_counter() - wall_start,
+        "cpu_time": time.process_time() - cpu_start,
+    }
+    if _worker_data.get("metrics"):
+        result["metrics"] = metrics.as_dict()
+    return result
+
+
+def episode_rank(result):
+    """ Ranking key of an episode result: feasible first, then highest reward, then lowest cost """
+    return (result["feasible"], result["reward"], -result["cost"])
 
 def has_enough_budget(budget: int, timestep_cost: int) -> bool:
     """
@@ -17,84 +80,244 @@ def has_enough_budget(budget: int, timestep_cost: int) -> bool:
     return budget >= timestep_cost
 
 class SimLearnHeuristic:
-    def __init__(self, total_budget: int, timestep_cost: int, num_simulations: int):
+    def __init__(self, total_budget: int, timestep_cost: int, num_simulations: int, collect_metrics: bool = False):
         """
         Initialize the SimLearnHeuristic instance.
 
         Parameters:
-            total_budget (int): The total budget in timesteps.
-            timestep_cost (int): The cost of a single emulation in timesteps.
-            num_simulations (int): The number of emulations to be performed.
+            total_budget (int): The total budget in seconds (wall-clock or CPU, see run_procedure).
+            timestep_cost (int): Initial estimate of the time of a single emulation in seconds,
+                replaced by the mean measured time once episodes have finished.
+            num_simulations (int): The maximum number of emulations to be performed (0 for no limit).
+            collect_metrics (bool): Enable the counters and timers of the framework (see get_metrics).
         """
         self.total_budget = total_budget
         self.timestep_cost = timestep_cost
         self.num_simulations = num_simulations
         self.solution_pool = []
+        self.nodes = None
+        self.max_cost = None
+        self.worker_memory = {}
+        if collect_metrics:
+            metrics.enable()
+
+    def get_metrics(self) -> dict:
+        """
+        Counters and timers of the phases (see Metrics) collected in this process and in the workers
+        of run_procedure, with the peak memory of this process and the highest one of the workers.
+        """
+        result = metrics.as_dict()
+        result["enabled"] = metrics.enabled
+        if self.worker_memory:
+            result["worker_memory"] = dict(self.worker_memory)
+        return result
+
+    def metrics_json(self, **kwargs) -> str:
+        return json.dumps(self.get_metrics(), **kwargs)
 
     def initialize(self, path):
         importer = Importer(path)
         # importer.print_nodes()
         nodes = importer.node_data
         routeMaxCost = importer.Tmax
+        self.nodes, self.max_cost = nodes, routeMaxCost
 
         return nodes, routeMaxCost
 
-    def run_heuristic(self, type, nodes, max_cost) -> Emulation:
+    def run_heuristic(self, type, nodes, max_cost, alpha: float = 0.5, criterion: str = "reward",
+                      n_scenarios: int = 1000, seed: int = None, cache: ReplanCache = None,
+                      local_search: bool = False, k_nearest: int = None, use_br: bool = False,
+                      **policy_options) -> Emulation:
         """
         Run the heuristic procedure of the selected "type":
             - "basic_pj": request new route using PJ heuristic for next emulation step
+            - "rollout": select the next step by Monte Carlo lookahead (RolloutPolicy), with
+              the policy options given as keyword arguments
+        The alpha value of the efficiency list is tuned (EfficiencyList.tune_alpha) if alpha is None
+        The route of each "basic_pj" step is chosen by criterion (see Solution.get_best_route); the
+        stochastic criteria evaluate the candidate routes under n_scenarios sampled dynamic parameters
+        With a seed, the dynamic parameters of the steps (and the scenarios and rollouts) are drawn
+        from their own random stream, so that episodes with different seeds differ
+        The "basic_pj" replans go through the cache if given (a ReplanCache, which can be shared by
+        the episodes of a process), and their best route is improved by a LocalSearch if local_search is True
+        The "basic_pj" replans are greedy, so without use_br episodes only differ by their dynamic
+        parameters; with use_br they are biased-randomized from a random stream of the seed (and
+        the cache is not used), so that episodes with different seeds build different routes
+        With k_nearest, "basic_pj" uses a sparse efficiency list (see EfficiencyList) for large instances
         """
+        rng = random.Random(seed) if seed is not None else None
         if type == "basic_pj":
             emulator = Emulation(nodes, max_cost)
-            eff_list = EfficiencyList(nodes)
-            eff_list.generate(alpha=0.5)
+            eff_list = EfficiencyList(nodes, emulator.geometry, k_nearest=k_nearest)
+            eff_list.generate(alpha=0.5 if alpha is None else alpha)
+            if alpha is None:
+                alpha, _ = eff_list.tune_alpha(max_cost)
+            scenarios = dynamic_scenarios(n_scenarios, seed=seed) if criterion != "reward" else None
+            improver = LocalSearch(nodes, emulator.geometry) if local_search else None
+            # stream of the BR replans, independent of the dynamic parameters one
+            br_rng = random.Random(int(np.random.SeedSequence(seed).generate_state(1)[0])) if use_br else None
             #TODO: stoping condition outside emulator required: a new step is still feasible?
             remaining_nodes_num = float("inf")
             while remaining_nodes_num > 1:
-                solution = generate_new_route(emulator)
+                solution = generate_new_route(emulator, eff_list, alpha, cache=cache, local_search=improver, rng=br_rng)
                 if solution:
-                    emulator.update_parameters(dynamic_param())
-                    emulator.step(solution.get_best_route().get_nodes()[1])
-                    print(emulator.get_current_state())
+                    evaluation = None
+                    if scenarios is not None:
+                        evaluation = solution.evaluate_routes(scenarios, max_cost, emulator.path_len, emulator.current_cost)
+                    best_route = solution.get_best_route(criterion, evaluation)
+                    emulator.update_parameters(dynamic_param(rng=rng))
+                    emulator.step(best_route.get_nodes()[1])
+                    logger.debug("%s", emulator.get_current_state())
                     remaining_nodes_num = len(solution.candidate_routes)
                 else:
                     break
             emulator.step(nodes[-1].id) # perform last step to final node (depot)
             return emulator
+        elif type == "rollout":
+            emulator = Emulation(nodes, max_cost)
+            policy_options.setdefault("seed", seed)
+            policy = RolloutPolicy(nodes, max_cost, emulator.geometry, **policy_options)
+            try:
+                end_node = emulator.greedy_selector.end_node
+                while emulator.current_node is not end_node:
+                    next_node = policy.select(emulator)
+                    emulator.update_parameters(dynamic_param(rng=rng))
+                    emulator.step(next_node.id)
+                    logger.debug("%s", emulator.get_current_state())
+            finally:
+                policy.close()
+            return emulator
         else:
-            print("Invalid type.")
+            logger.error("Invalid type: %s", type)
             return None
 
-    def run_procedure(self) -> int:
+    def run_procedure(self, type: str = "basic_pj", budget_type: str = "wall", workers: int = None,
+                      seed: int = None, pool_size: int = 10, **options):
         """
-        Run the SimLearnHeuristic procedure.
+        Run the SimLearnHeuristic procedure: emulation episodes of the selected type (see run_heuristic,
+        which receives the options) run across a process pool, each one with its own seed, until the
+        total budget is used up. The budget is charged with the measured time of the episodes:
+            - "wall": wall-clock seconds since the start of the procedure
+            - "cpu": CPU seconds of the finished episodes, summed over the workers
+        A new episode is only started if the remaining budget covers the estimated time of an
+        episode (timestep_cost at first, then the mean measured time) for each running episode.
+        The best pool_size episodes are kept in solution_pool, best first.
+        The "basic_pj" replans are greedy by default: every episode then follows the same route and
+        the pool only ranks the draws of the dynamic parameters (the luckiest ones first). With
+        use_br=True (see run_heuristic) each episode builds its own routes, at the price of slower
+        and individually worse replans.
+        The options are sent once to each worker process, so a ReplanCache given as cache is shared
+        by the episodes of a worker (by all of them with a single worker).
 
         Returns:
-            int: The best solution found from the emulations.
+            dict: The best episode found (path, reward, cost, feasible...), or None.
         """
-        while has_enough_budget(self.total_budget, self.timestep_cost):
-            result = self.run_emulation()
-            self.solution_pool.append(result)
-            #TODO: use time or resource module to know the timestep_cost of running each solution
-            self.total_budget -= self.timestep_cost
+        if self.nodes is None:
+            raise ValueError("No instance: call initialize first")
+        if budget_type not in ("wall", "cpu"):
+            raise ValueError(f"Invalid budget type: {budget_type}")
+        workers = workers or os.cpu_count() or 1
+        if type == "rollout":
+            options.setdefault("workers", 1)  # episodes are already run in parallel
+        seeds = np.random.SeedSequence(seed)
+        start = time.perf_counter()
+        used, n_started, n_finished, time_sum = 0.0, 0, 0, 0.0
+        pool = []  # min-heap of (rank, order, result) with the best pool_size episodes
+
+        def remaining_budget(running):
+            spent = time.perf_counter() - start if budget_type == "wall" else used
+            estimate = time_sum / n_finished if n_finished else self.timestep_cost
+            return self.total_budget - spent - estimate * running, estimate
+
+        def can_start(running):
+            if self.num_simulations and n_started >= self.num_simulations:
+                return False
+            budget, estimate = remaining_budget(running)
+            return has_enough_budget(budget, estimate)
 
-        best_solution = max(self.solution_pool)
-        return best_solution
+        def next_task():
+            episode_seed = int(seeds.spawn(1)[0].generate_state(1)[0])
+            return (type, episode_seed)
+
+        def record(result):
+            nonlocal used, n_finished, time_sum
+            episode_time = result["wall_time"] if budget_type == "wall" else result["cpu_time"]
+            used += result["cpu_time"]
+            time_sum += episode_time
+            n_finished += 1
+            metrics.count("episodes")
+            if "metrics" in result:
+                episode_metrics = result.pop("metrics")
+                metrics.merge(episode_metrics)
+                for name, value in episode_metrics["memory"].items():
+                    self.worker_memory[name] = max(value, self.worker_memory.get(name, 0))
+            item = (episode_rank(result), n_finished, result)
+            if len(pool) < pool_size:
+                heapq.heappush(pool, item)
+            elif item[0] > pool[0][0]:
+                heapq.heapreplace(pool, item)
+
+        # the metrics of worker processes are sent back with their episodes
+        initargs = (options, workers > 1 and metrics.enabled)
+        with WorkerPool(_init_episode_worker, self.nodes, self.max_cost, initargs=initargs, workers=workers) as worker_pool:
+            if workers == 1:
+                while can_start(0):
+                    n_started += 1
+                    record(_run_episode(next_task()))
+            else:
+                running = set()
+                while True:
+                    while len(running) < workers and can_start(len(running)):
+                        n_started += 1
+                        running.add(worker_pool.submit(_run_episode, next_task()))
+                    if not running:
+                        break
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record(future.result())
+
+        self.solution_pool = [result for _, _, result in sorted(pool, key=lambda item: (item[0], -item[1]), reverse=True)]
+        logger.info("%d episodes in %.2fs (%s budget %.2fs, used %.2fs)", n_finished, time.perf_counter() - start,
+                    budget_type, self.total_budget, used if budget_type == "cpu" else time.perf_counter() - start)
+        return self.solution_pool[0] if self.solution_pool else None
 
 if __name__ == "__main__":
-    # Example usage with a budget of 10000 timesteps and an emulation cost of 100 timesteps
-    budget: int = 10000
-    emulation_cost: int = 100
-    number_of_emulations: int = 50
-
-    # procedure = SimLearnHeuristic(budget, emulation_cost, number_of_emulations)
-    # best_solution: int = procedure.run_procedure()
-    # print("Best Solution:", best_solution)
-
-    # file_path = "input/ref/Tsiligirides 1/tsiligirides_problem_1_budget_05 - Copy.txt"
-    file_path = "input/ref/Tsiligirides 3/tsiligirides_problem_3_budget_070.txt"
-    # file_path = "input/ref/set_64_1/set_64_1_15.txt"
-    procedure = SimLearnHeuristic(budget, emulation_cost, number_of_emulations)
-    network, maxCost = procedure.initialize(file_path)
-    result = procedure.run_heuristic("basic_pj", network, maxCost)
-    print(result.get_current_state())
+    parser = argparse.ArgumentParser(description="SimLearnHeuristic procedure on an OP instance")
+    # parser.add_argument("--file", default="input/ref/Tsiligirides 1/tsiligirides_problem_1_budget_05 - Copy.txt")
+    # parser.add_argument("--file", default="input/ref/set_64_1/set_64_1_15.txt")
+    parser.add_argument("--file", default="input/ref/Tsiligirides 3/tsiligirides_problem_3_budget_070.txt")
+    parser.add_argument("--type", default="basic_pj", choices=["basic_pj", "rollout"])
+    parser.add_argument("--budget", type=float, default=60, help="total budget of the procedure (seconds)")
+    parser.add_argument("--emulation-cost", type=float, default=1, help="initial estimate of the time of an emulation (seconds)")
+    parser.add_argument("--simulations", type=int, default=50, help="maximum number of emulations (0 for no limit)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--metrics", action="store_true", help="collect the per-phase counters and timers")
+    parser.add_argument("--metrics-output", default=None, help="JSON file of the metrics (printed if not given)")
+    parser.add_argument("--profile", nargs="?", const="", default=None, metavar="FILE",
+                        help="run under cProfile (and dump the raw profile to FILE)")
+    parser.add_argument("--profile-sort", default="cumulative", help="sort key of the printed profile")
+    parser.add_argument("--tracemalloc", type=int, nargs="?", const=10, default=None, metavar="N",
+                        help="trace the Python allocations and print the N top source lines")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+    set_log_level(getattr(logging, args.log_level.upper()))
+
+    procedure = SimLearnHeuristic(args.budget, args.emulation_cost, args.simulations, collect_metrics=args.metrics)
+    with contextlib.ExitStack() as stack:
+        if args.profile is not None:
+            stack.enter_context(profiled(args.profile or None, sort=args.profile_sort))
+        if args.tracemalloc is not None:
+            stack.enter_context(traced_memory(args.tracemalloc))
+        network, maxCost = procedure.initialize(args.file)
+        result = procedure.run_heuristic(args.type, network, maxCost, seed=args.seed)
+        print(result.get_current_state())
+        best_solution = procedure.run_procedure(args.type, workers=args.workers, seed=args.seed)
+        print("Best Solution:", best_solution)
+
+    if args.metrics:
+        if args.metrics_output:
+            with open(args.metrics_output, "w") as file:
+                file.write(procedure.metrics_json(indent=2))
+        else:
+            print(procedure.metrics_json(indent=2))
@@ -1,46 +1,141 @@
 import operator
 import copy
 
+import numpy as np
+
 from node import Node, euclidean_distance
 from arc import Arc
 from route import Route
+from geometry import Geometry
+from logs import get_logger
+from metrics import timed
 from importer import Importer
 
+logger = get_logger(__name__)
+
 class Solution():
     def __init__(self, id: int = 0) -> None:
         self.id = id
         self.candidate_routes = []
+        self.route_by_node = {}  # customer node -> candidate route visiting it
+        self.stats = {}  # statistics of the construction (see pj_heuristic)
+
+    def evaluate_routes(self, scenarios, max_cost: float, start_step: int = 1, base_cost: float = 0.0,
+                        quantiles=(0.5, 0.9, 0.95), variability: float = 1):
+        """
+        Evaluate the cost of every candidate route under S scenarios of the dynamic parameters at once.
+        The cost of a route is base_cost plus, for each leg k = 0, 1, ..., its static cost plus the
+        dynamic component of the step start_step + k (see emulation.dynamic_function), so the
+        dynamic part only depends on the number of legs: it is cumulated once per scenario.
+
+        :param scenarios: array (S, n_param) of dynamic parameters (see emulation.dynamic_scenarios).
+        :param max_cost: maximum cost of the route.
+        :param start_step: step index of the first leg (path length of the emulation when replanning).
+        :param base_cost: cost already accumulated before the first leg.
+        :param quantiles: cost quantile levels to report.
+        :param variability: amplitude of the dynamic component.
+        :return: dictionary with the evaluated routes and arrays indexed as them: expected_cost,
+            quantiles (one row per quantile level), feasible_prob (P(cost <= max_cost)).
+        """
+        scenarios = np.atleast_2d(np.asarray(scenarios, dtype=float))
+        routes = list(self.candidate_routes)
+        legs = np.fromiter((len(route.arcs) for route in routes), dtype=np.intp, count=len(routes))
+        static_costs = np.fromiter((route.cost for route in routes), dtype=float, count=len(routes))
+        n_legs = int(legs.max()) if len(routes) else 0
+        # dynamic[s, L] = dynamic cost of the first L legs under scenario s
+        tsteps = start_step + np.arange(n_legs)
+        step_deltas = (variability * np.sin(tsteps[:, np.newaxis, np.newaxis] * np.pi * scenarios)).sum(axis=2).T
+        dynamic = np.zeros((len(scenarios), n_legs + 1))
+        np.cumsum(step_deltas, axis=1, out=dynamic[:, 1:])
+        costs = base_cost + static_costs[:, np.newaxis] + dynamic[:, legs].T  # (routes, scenarios)
+        return {
+            "routes": routes,
+            "expected_cost": costs.mean(axis=1),
+            "quantile_levels": tuple(quantiles),
+            "quantiles": np.quantile(costs, quantiles, axis=1),
+            "feasible_prob": (costs <= max_cost).mean(axis=1),
+        }
 
-    def get_best_route(self):
+    def get_best_route(self, criterion: str = "reward", evaluation=None, min_feasible_prob: float = 0.95):
+        """
+        Best candidate route for the criterion:
+            - "reward": highest reward, then lowest (static) cost
+            - "expected_cost": highest reward, then lowest expected cost
+            - "feasible_prob": highest probability of staying under the max cost, then highest reward
+            - "robust": highest reward among the routes with a probability of staying under the
+              max cost of at least min_feasible_prob, then lowest expected cost
+              (the route with the highest probability if there is none)
+        The stochastic criteria rank the routes of an evaluation returned by evaluate_routes.
+        """
         best_route = None
         if not self.candidate_routes:
-            print("No routes available in solution.")
+            logger.warning("No routes available in solution.")
             return None
+        if criterion != "reward":
+            if evaluation is None:
+                raise ValueError(f"Criterion {criterion} requires an evaluation of the routes")
+            return self._rank_evaluation(criterion, evaluation, min_feasible_prob)
         # sort the list of routes in sol by reward and cost
         self.candidate_routes.sort(key = operator.attrgetter("cost"), reverse = False)
         self.candidate_routes.sort(key = operator.attrgetter("reward"), reverse = True)
         best_route = self.candidate_routes[0]
         return best_route
 
+    @staticmethod
+    def _rank_evaluation(criterion: str, evaluation, min_feasible_prob: float):
+        routes = evaluation["routes"]
+        rewards = np.fromiter((route.reward for route in routes), dtype=float, count=len(routes))
+        expected_cost = evaluation["expected_cost"]
+        feasible_prob = evaluation["feasible_prob"]
+        if criterion == "expected_cost":
+            order = np.lexsort((expected_cost, -rewards))
+        elif criterion == "feasible_prob":
+            order = np.lexsort((-rewards, -feasible_prob))
+        elif criterion == "robust":
+            robust = feasible_prob >= min_feasible_prob
+            if not robust.any():
+                order = np.lexsort((-rewards, -feasible_prob))
+            else:
+                order = np.lexsort((expected_cost, -rewards, ~robust))
+        else:
+            raise ValueError(f"Invalid criterion: {criterion}")
+        return routes[order[0]]
+
     def add_route(self, route: Route):
         self.candidate_routes.append(route)
+        for node in route.get_customers():
+            self.route_by_node[node] = route
 
     def remove_route(self, route: Route):
         self.candidate_routes.remove(route)
+        for node in route.get_customers():
+            if self.route_by_node.get(node) is route:
+                del self.route_by_node[node]
+
+    def merge_routes(self, route_i: Route, route_j: Route, arc_i_j: Arc):
+        """
+        Merge route_j into route_i through arc (i, j), where i is the last customer of route_i
+        and j is the first customer of route_j. route_j is removed from the solution.
+        """
+        # node i will not be linked to finish depot anymore, nor node j to the start depot
+        route_i.merge(route_j, arc_i_j)
+
+        # delete route_j from emerging solution
+        self.candidate_routes.remove(route_j)
+        for node in route_j.get_customers():
+            self.route_by_node[node] = route_i
+        return route_i
 
     def get_route_by_node(self, node):
-        for route in self.candidate_routes:
-            # print(route)
-            for arc in route.arcs:
-                if arc.start == node or arc.end == node:
-                    return route
         # print(f"Node {node.id} not found in route.")
-        return None
+        return self.route_by_node.get(node)
 
 
-def dummy_solution(input_nodes, route_max_cost):
+@timed("dummy_solution")
+def dummy_solution(input_nodes, route_max_cost, geometry: Geometry = None):
     """
     If any dummy route has a higher cost than the max cost allowed it is not consider in the solution
+    Distances are looked up in the (optional) precomputed geometry of the instance
     """
     solution = Solution()
     available_nodes = copy.copy(input_nodes)
@@ -49,14 +144,14 @@ def dummy_solution(input_nodes, route_max_cost):
     available_nodes.remove(start_node)
     available_nodes.remove(end_node)
     for node in available_nodes: # excludes the start_node and end_node 
-        start_arc = Arc(start_node, node) # creates the (start_node, node) edge (arc)
-        end_arc = Arc(node, end_node) # creates the (node, end_node) edge (arc)
+        start_arc = Arc(start_node, node, geometry) # creates the (start_node, node) edge (arc)
+        end_arc = Arc(node, end_node, geometry) # creates the (node, end_node) edge (arc)
         route = Route()
         route.add_arc(start_arc)
         route.add_arc(end_arc)
         if route.cost <= route_max_cost:
             solution.add_route(route)
-    print(f"Dummy solution created with {len(solution.candidate_routes)} routes")
+    logger.debug("Dummy solution created with %d routes", len(solution.candidate_routes))
     return solution
 
 def find_start_node(node_list):
@@ -66,17 +161,17 @@ def find_start_node(node_list):
     for node in node_list:
         if node.is_start:
             return node
-    print("No starting node found.")
+    logger.warning("No starting node found.")
     return None
 
 def find_end_node(node_list):
     """
-    Given a network (list of nodes), find the starting node (depot)
+    Given a network (list of nodes), find the ending node (depot)
     """
     for node in node_list:
         if node.is_end:
             return node
-    print("No starting node found.")
+    logger.warning("No ending node found.")
     return None
 
 